@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+"""
+    Throughput benchmark of the decrypters over a corpus of synthetic books
+    (see mobigen). Reports the time taken, MB/s and records/s for every book
+    and the peak memory use of the run, so that changes to the cipher or
+    the I/O path can be compared with numbers.
+
+        $ python mobigen.py /tmp/corpus
+        $ python benchmark.py mobi /tmp/corpus
+
+    The topaz benchmark times every stage of the conversion of a Topaz book
+    (see topazgen) through files separately instead, and the conversion in
+    memory.
+
+        $ python topazgen.py -p 600 /tmp/book.tpz
+        $ python benchmark.py topaz /tmp/book.tpz
+"""
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+import mobidedrm
+import mobigen
+import topazgen
+from topaz import cmbtc, decode_meta, genbook, genhtml, gensvg
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+def peak_rss():
+    """
+        Return the peak resident set size in KiB of this process and its
+        finished children, or None if it can't be found out.
+    """
+    if resource is None:
+        return None
+    rss = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who).ru_maxrss
+        if sys.platform == "darwin":
+            # bytes instead of KiB
+            usage //= 1024
+        rss = max(rss, usage)
+    return rss
+
+def bench_mobi(path, pid, processes=0, streaming=False, repeat=1):
+    """
+        Decrypt the book at path repeat times and return the best time in
+        seconds and the number of text records.
+    """
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        if streaming:
+            fd, outpath = tempfile.mkstemp(suffix=".mobi")
+            os.close(fd)
+            try:
+                stripper = mobidedrm.StreamingDrmStripper(path, pid, processes)
+                try:
+                    stripper.writeResult(outpath)
+                finally:
+                    stripper.close()
+            finally:
+                os.remove(outpath)
+        else:
+            data = open(path, "rb").read()
+            stripper = mobidedrm.DrmStripper(data, pid, processes)
+            stripper.getResult()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, stripper.records
+
+def report(rows):
+    """
+        Print a table of (name, bytes, records, seconds) rows.
+    """
+    print "%-24s %10s %8s %8s %8s %10s" % ("book", "bytes", "records", "seconds", "MB/s", "records/s")
+    total_size = total_records = total_time = 0
+    for name, size, records, elapsed in rows:
+        elapsed = max(elapsed, 1e-6)
+        print "%-24s %10d %8d %8.3f %8.2f %10.0f" % (name, size, records, elapsed,
+                                                     size / elapsed / (1 << 20), records / elapsed)
+        total_size += size
+        total_records += records
+        total_time += elapsed
+    if rows:
+        total_time = max(total_time, 1e-6)
+        print "%-24s %10d %8d %8.3f %8.2f %10.0f" % ("total", total_size, total_records, total_time,
+                                                     total_size / total_time / (1 << 20), total_records / total_time)
+    rss = peak_rss()
+    if rss is not None:
+        print "peak RSS: %d KiB" % rss
+
+def run_mobi(options, args):
+    pid = mobidedrm.getPid(options.serial)
+    paths = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend(sorted(glob.glob(os.path.join(arg, "*.azw"))))
+        else:
+            paths.append(arg)
+    if not paths:
+        tmp = tempfile.mkdtemp()
+        print "Generating corpus in %s" % tmp
+        paths = mobigen.make_corpus(tmp, options.serial)
+
+    rows = []
+    for path in paths:
+        elapsed, records = bench_mobi(path, pid, options.jobs, options.streaming, options.repeat)
+        rows.append((os.path.basename(path), os.path.getsize(path), records, elapsed))
+    report(rows)
+
+class Stages(object):
+    """
+        Times the stages of a run. The stages print their progress, which
+        is thrown away while they run.
+    """
+    def __init__(self):
+        self.times = []
+
+    def run(self, name, function, *args, **kwargs):
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            start = time.time()
+            result = function(*args, **kwargs)
+            self.times.append((name, time.time() - start))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        return result
+
+    def report(self):
+        total = max(sum([elapsed for name, elapsed in self.times]), 1e-6)
+        print "%-12s %8s %6s" % ("stage", "seconds", "share")
+        for name, elapsed in self.times:
+            print "%-12s %8.3f %5.1f%%" % (name, elapsed, elapsed * 100 / total)
+        print "%-12s %8.3f" % ("total", total)
+
+def open_topaz(path, pid):
+    """
+        Open the Topaz book at path and find its key.
+    """
+    book = cmbtc.TopazBook(path)
+    keys = cmbtc.decryptDkeyRecords(book.get_record("dkey", 0), pid)
+    if not keys:
+        book.close()
+        raise cmbtc.CMBDTCFatal("no book key found for PID " + pid)
+    book.key = keys[0]
+    return book
+
+def bench_topaz(path, pid):
+    """
+        Convert the Topaz book at path like process.py does and return the
+        time taken by every stage.
+    """
+    stages = Stages()
+    tmp = tempfile.mkdtemp()
+    try:
+        book = stages.run("header", open_topaz, path, pid)
+        try:
+            stages.run("dump", cmbtc.createDecryptedBook, book, tmp)
+        finally:
+            book.close()
+
+        dictFile = os.path.join(tmp, "dict0000.dat")
+        pageDir = os.path.join(tmp, "page")
+        svgDir = os.path.join(tmp, "svg")
+        os.makedirs(svgDir)
+        glyfname = os.path.join(svgDir, "glyphs.svg")
+        metadata = decode_meta.getMetaArray(os.path.join(tmp, "metadata0000.dat"))
+        filenames = sorted(os.listdir(pageDir))
+
+        stages.run("glyph svg", gensvg.generateGlyphs, dictFile, os.path.join(tmp, "glyphs"), glyfname, metadata)
+        stages.run("page svg", gensvg.generatePages, dictFile, pageDir, svgDir, glyfname, metadata, 0)
+        classlst = stages.run("css", genhtml.generateCSS, tmp, dictFile, pageDir, metadata)
+        stages.run("html", genhtml.generateHTML, dictFile, pageDir, tmp, filenames, classlst, False)
+    finally:
+        shutil.rmtree(tmp)
+    return stages
+
+def bench_topaz_memory(path, pid, threads=0, processes=0):
+    """
+        Convert the Topaz book at path like process.py does, in memory with
+        genbook, and return the time taken by every stage. The records are
+        extracted on threads threads or processes processes.
+    """
+    stages = Stages()
+    tmp = tempfile.mkdtemp()
+    try:
+        book = stages.run("header", open_topaz, path, pid)
+        try:
+            stages.run("convert", genbook.convertBook, book, tmp, threads=threads, processes=processes)
+        finally:
+            book.close()
+    finally:
+        shutil.rmtree(tmp)
+    return stages
+
+def run_topaz(options, args):
+    pid = mobidedrm.getPid(options.serial)[:8]
+    paths = list(args)
+    generated = None
+    if not paths:
+        fd, generated = tempfile.mkstemp(suffix=".tpz")
+        os.close(fd)
+        print "Generating a book of %d pages in %s" % (options.pages, generated)
+        open(generated, "wb").write(topazgen.make_book(options.serial, options.pages))
+        paths.append(generated)
+
+    try:
+        for path in paths:
+            print "%s: %d bytes" % (os.path.basename(path), os.path.getsize(path))
+            bench_topaz(path, pid).report()
+            print "in memory:"
+            bench_topaz_memory(path, pid, options.threads, options.jobs).report()
+    finally:
+        if generated:
+            os.remove(generated)
+    rss = peak_rss()
+    if rss is not None:
+        print "peak RSS: %d KiB" % rss
+
+COMMANDS = {
+    "mobi": run_mobi,
+    "topaz": run_topaz,
+}
+
+if __name__ == "__main__":
+    parser = OptionParser("usage: %prog [options] " + "|".join(sorted(COMMANDS)) + " [book or directory...]")
+    parser.add_option("-s", "--serial", default=mobigen.SERIAL,
+                      help="Kindle serial number the books are for [%default]")
+    parser.add_option("-j", "--jobs", type="int", default=0,
+                      help="Decrypt on a pool of JOBS processes")
+    parser.add_option("-t", "--threads", type="int", default=0,
+                      help="Extract Topaz records on THREADS threads")
+    parser.add_option("-r", "--repeat", type="int", default=1,
+                      help="Take the best of REPEAT runs of every book")
+    parser.add_option("--streaming", action="store_true", default=False,
+                      help="Decrypt from file to file with StreamingDrmStripper")
+    parser.add_option("-p", "--pages", type="int", default=50,
+                      help="Number of pages of the generated Topaz book [%default]")
+    options, args = parser.parse_args()
+    if not args or args[0] not in COMMANDS:
+        parser.error("no benchmark given")
+
+    COMMANDS[args[0]](options, args[1:])
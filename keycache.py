@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+"""
+    Persistent cache of book keys. Books are identified by a fingerprint of
+    the part of the file that holds their DRM information (record 0 of a
+    Mobipocket book, the dkey record of a Topaz book), so processing the
+    same book again can skip looking for its key.
+
+    The decrypters only rely on the get(kind, data) and put(kind, data, key)
+    methods, so they don't need to import this module.
+"""
+
+import collections
+import errno
+import hashlib
+import os
+import tempfile
+import time
+
+CACHE = os.path.expanduser("~/.kindledecrypt-keys")
+
+def fingerprint_of(kind, data):
+    """
+        Return the fingerprint of a book of the given kind ("mobi" or
+        "topaz") from the data holding its DRM information.
+    """
+    return kind + ":" + hashlib.sha1(data).hexdigest()
+
+def read_entries(path):
+    """
+        Read the cache file at path into an OrderedDict of fingerprints to
+        keys, least recently used first. A missing file is an empty cache,
+        malformed lines are skipped.
+    """
+    entries = collections.OrderedDict()
+    if os.path.exists(path):
+        for line in open(path, "r"):
+            fields = line.split()
+            if len(fields) != 2:
+                continue
+            try:
+                entries[fields[0]] = fields[1].decode("hex")
+            except TypeError:
+                continue
+    return entries
+
+class KeyCache(object):
+    """
+        Maps book fingerprints to book keys. The cache holds at most
+        max_entries books and forgets the least recently used ones first.
+        New keys and cache hits are written to disk by save(), which merges
+        them with what other processes saved in the meantime. Use like:
+
+            >>> cache = KeyCache()
+            >>> key = cache.get("mobi", record0)
+            >>> if key is None:
+            >>>     key = find_key()
+            >>>     cache.put("mobi", record0, key)
+            >>> cache.save()
+
+        Looking keys up doesn't write anything, the hits are recorded and
+        moved to the most recently used end of the file by the next save().
+    """
+    def __init__(self, path=CACHE, max_entries=10000, lock_timeout=10):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock_timeout = lock_timeout
+        self.entries = read_entries(path)
+        # the keys put or hit since the cache was loaded or saved, in the
+        # order they were last used
+        self.used = collections.OrderedDict()
+
+    def get(self, kind, data):
+        """
+            Get the key of a book or None if it is not in the cache.
+        """
+        fingerprint = fingerprint_of(kind, data)
+        key = self.entries.pop(fingerprint, None)
+        if key is not None:
+            # move it to the most recently used end
+            self.entries[fingerprint] = key
+            self.used.pop(fingerprint, None)
+            self.used[fingerprint] = key
+        return key
+
+    def put(self, kind, data, key):
+        """
+            Remember the key of a book, evicting the least recently used
+            books if the cache is full.
+        """
+        fingerprint = fingerprint_of(kind, data)
+        self.entries.pop(fingerprint, None)
+        self.entries[fingerprint] = key
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.used.pop(fingerprint, None)
+        self.used[fingerprint] = key
+
+    def save(self):
+        """
+            Add the new keys to the cache file and move the keys that were
+            hit to its most recently used end, if there are any. The file
+            is read again under a lock file, so keys saved by other
+            processes since it was loaded are kept, and it is replaced
+            atomically so concurrent readers never see a partial cache.
+        """
+        if not self.used:
+            return
+
+        self._lock()
+        try:
+            entries = read_entries(self.path)
+            for fingerprint, key in self.used.iteritems():
+                entries.pop(fingerprint, None)
+                entries[fingerprint] = key
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._write(entries)
+        finally:
+            self._unlock()
+        self.entries = entries
+        self.used.clear()
+
+    def _write(self, entries):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        try:
+            out = os.fdopen(fd, "w")
+            for fingerprint, key in entries.iteritems():
+                out.write("%s %s\n" % (fingerprint, key.encode("hex")))
+            out.close()
+            os.chmod(tmp, 0600)
+            if os.name == "nt" and os.path.exists(self.path):
+                # rename doesn't replace existing files on Windows
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+        except:
+            os.remove(tmp)
+            raise
+
+    def _lock(self):
+        # The lock is a file created exclusively next to the cache. A lock
+        # older than lock_timeout is left over from a process that died
+        # while saving and is taken over.
+        lockpath = self.path + ".lock"
+        while True:
+            try:
+                os.close(os.open(lockpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0600))
+                return
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            try:
+                stale = time.time() - os.path.getmtime(lockpath) > self.lock_timeout
+            except OSError:
+                # removed in the meantime
+                continue
+            if stale:
+                try:
+                    os.remove(lockpath)
+                except OSError:
+                    pass
+                continue
+            time.sleep(0.05)
+
+    def _unlock(self):
+        try:
+            os.remove(self.path + ".lock")
+        except OSError:
+            pass
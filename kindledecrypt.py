@@ -133,8 +133,7 @@ class MobiDeDrmApp(wx.App):
         # Which type of book is this?
         ext = ""
         try:
-            topaz.cmbtc.bookFile = topaz.cmbtc.openBook(infile)
-            topaz.cmbtc.parseTopazHeader()
+            topaz.cmbtc.TopazBook(infile).close()
         except topaz.cmbtc.CMBDTCFatal:
             ext = ".mobi"
         
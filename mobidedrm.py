@@ -44,17 +44,69 @@
 #  0.17 - Added ability to extract PID given a Kindle serial number, added
 #         OptionParser interface to argument processing, allow import as a
 #         library without assuming Calibre is importing it
+#  0.18 - Table driven PC1 engine decrypting into a preallocated bytearray,
+#         several times faster on long files.
+#  0.19 - Added StreamingDrmStripper, which writes each record to the output
+#         file as it is decrypted instead of holding the whole book in memory.
+#  0.20 - DrmStripper accepts memory mapped files and hands out zero copy
+#         views of the sections, only records that get decrypted are copied.
+#  0.21 - Optionally decrypt the records of large books on a process pool
+#         (-j option).
+#  0.22 - Build the decrypted book in one preallocated buffer, patching
+#         record 0 and decrypting the text records in place.
+#  0.23 - Added probeKey to find the PID that unlocks a book from record 0
+#         alone, the Calibre plugin no longer decrypts the book once per PID.
+#  0.24 - Optional cache of book keys, so books processed before skip the
+#         key search.
+#  0.25 - Work out the trailing data entry sizes of all records in one pass
+#         before decrypting them.
+#  0.26 - Progress and timing callbacks for each phase, messages go through
+#         the logging module.
+#  0.27 - Decrypt batches of text records in lockstep with numpy when it is
+#         available.
+#  0.28 - Parallel decryption writes the records in place into an output
+#         file of the size of the book.
 
-__version__ = '0.17'
+__version__ = '0.28'
 
+import os
 import sys
+import mmap
+import shutil
+import tempfile
+import time
+import array
 import struct
+import logging
 import binascii
+import collections
+import multiprocessing
 
 from optparse import OptionParser
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 letters = "ABCDEFGHIJKLMNPQRSTUVWXYZ123456789"
 
+log = logging.getLogger("mobidedrm")
+log.addHandler(logging.NullHandler())
+
+# Books whose text records take less than this many bytes are always
+# decrypted serially, starting a process pool is not worth it for them
+PARALLEL_THRESHOLD = 4 << 20
+
+# Number of text records decrypted in lockstep by PC1Batch
+PC1_BATCH = 512
+
+# Runs of fewer text records than this are decrypted one at a time with
+# PC1Fast, every byte position of a lockstep step has a fixed numpy cost
+# that only pays off for enough records (break even is around 48 records
+# of 4 KB)
+PC1_BATCH_MIN = 48
+
 class Unbuffered:
     def __init__(self, stream):
         self.stream = stream
@@ -101,6 +153,153 @@ def PC1(key, src, decryption=True):
         dst+=chr(curByte)
     return dst
 
+# The temp1/sum1 chain of PC1 only depends on the key and on the running
+# xor of the plaintext bytes seen so far, so it can be computed once per key
+# for all 256 possible xor values. Only the sum2 chain is left for the
+# per byte loop.
+_pc1_tables = {}
+
+def PC1Tables(key):
+    tables = _pc1_tables.get(key)
+    if tables is not None:
+        return tables
+    wkey = []
+    for i in xrange(8):
+        wkey.append(ord(key[i*2])<<8 | ord(key[i*2+1]))
+    tables = []
+    for c in xrange(256):
+        keyXorVal = c * 257
+        temp1 = 0
+        tempXorVal = 0
+        sums = []
+        for j in xrange(8):
+            temp1 ^= wkey[j] ^ keyXorVal
+            sums.append((temp1*346)&0xFFFF)
+            temp1 = (temp1*20021+1)&0xFFFF
+            tempXorVal ^= temp1
+        # sum2 for step j is (sum2*20021 + adds[j]) & 0xFFFF
+        adds = [sums[0]]
+        for j in xrange(1, 8):
+            adds.append(j*20021 + sums[j-1] + sums[j])
+        tables.append(tuple(adds) + (tempXorVal, sums[7]))
+    if len(_pc1_tables) >= 64:
+        _pc1_tables.clear()
+    _pc1_tables[key] = tables
+    return tables
+
+# Table driven Pukall Cipher 1, byte for byte identical to PC1(). src can be
+# a string, bytearray, buffer or memoryview. The result is written into a
+# preallocated bytearray, either a new one which is returned or dst itself
+# at dst_off.
+def PC1Fast(key, src, decryption=True, dst=None, dst_off=0):
+    if len(key)!=16:
+        log.error("Bad key length!")
+        return None
+    tables = PC1Tables(key)
+    size = len(src)
+    if dst is None:
+        buf = bytearray(src)
+        off = 0
+    else:
+        buf = dst
+        off = dst_off
+        buf[off:off+size] = src
+    sum1 = 0
+    sum2 = 0
+    keyXor = 0
+    for i in xrange(off, off+size):
+        a0,a1,a2,a3,a4,a5,a6,a7,tempXorVal,s7 = tables[keyXor]
+        sum2 = (sum2*20021 + sum1 + a0)&0xFFFF
+        byteXorVal = tempXorVal ^ sum2
+        sum2 = (sum2*20021 + a1)&0xFFFF
+        byteXorVal ^= sum2
+        sum2 = (sum2*20021 + a2)&0xFFFF
+        byteXorVal ^= sum2
+        sum2 = (sum2*20021 + a3)&0xFFFF
+        byteXorVal ^= sum2
+        sum2 = (sum2*20021 + a4)&0xFFFF
+        byteXorVal ^= sum2
+        sum2 = (sum2*20021 + a5)&0xFFFF
+        byteXorVal ^= sum2
+        sum2 = (sum2*20021 + a6)&0xFFFF
+        byteXorVal ^= sum2
+        sum2 = (sum2*20021 + a7)&0xFFFF
+        byteXorVal ^= sum2
+        sum1 = s7
+        curByte = buf[i]
+        newByte = (curByte ^ (byteXorVal >> 8) ^ byteXorVal) & 0xFF
+        buf[i] = newByte
+        if decryption:
+            keyXor ^= newByte
+        else:
+            keyXor ^= curByte
+    if dst is None:
+        return str(buf)
+    return dst
+
+_pc1_batch_tables = {}
+
+def PC1BatchTables(key):
+    tables = _pc1_batch_tables.get(key)
+    if tables is None:
+        tables = numpy.array(PC1Tables(key), numpy.uint32).T.copy()
+        if len(_pc1_batch_tables) >= 64:
+            _pc1_batch_tables.clear()
+        _pc1_batch_tables[key] = tables
+    return tables
+
+# Pukall Cipher 1 over several independent sources with the same key,
+# returns a list of bytearrays, byte for byte identical to PC1() of each.
+# The keystream of a source depends on its own earlier bytes, but all of
+# them start from the same state. So with numpy the state of every source
+# is kept in arrays and all of them are advanced one byte position per
+# step, the longest sources first. Without numpy, or for fewer than
+# PC1_BATCH_MIN sources, this is PC1Fast on each.
+def PC1Batch(key, srcs, decryption=True):
+    if numpy is None or len(srcs) < PC1_BATCH_MIN or len(key) != 16:
+        return [PC1Fast(key, src, decryption, bytearray(len(src))) for src in srcs]
+    tables = PC1BatchTables(key)
+    count = len(srcs)
+    order = sorted(xrange(count), key=lambda i: len(srcs[i]), reverse=True)
+    lengths = [len(srcs[i]) for i in order]
+    # one row per byte position, one column per source
+    block = numpy.zeros((lengths[0], count), numpy.uint8)
+    for col, i in enumerate(order):
+        if not lengths[col]:
+            continue
+        if isinstance(srcs[i], memoryview):
+            block[:lengths[col], col] = numpy.asarray(srcs[i])
+        else:
+            block[:lengths[col], col] = numpy.frombuffer(srcs[i], numpy.uint8)
+    sum1 = numpy.zeros(count, numpy.uint32)
+    sum2 = numpy.zeros(count, numpy.uint32)
+    keyXor = numpy.zeros(count, numpy.intp)
+    # the sums only need 16 bits and stay below 2**32 before masking
+    active = count
+    for pos in xrange(lengths[0]):
+        while lengths[active-1] <= pos:
+            active -= 1
+        a = tables[:, keyXor[:active]]
+        s2 = (sum2[:active]*20021 + sum1[:active] + a[0]) & 0xFFFF
+        byteXorVal = a[8] ^ s2
+        for j in xrange(1, 8):
+            s2 = (s2*20021 + a[j]) & 0xFFFF
+            byteXorVal ^= s2
+        sum2[:active] = s2
+        sum1[:active] = a[9]
+        curByte = block[pos, :active]
+        newByte = ((curByte ^ (byteXorVal >> 8) ^ byteXorVal) & 0xFF).astype(numpy.uint8)
+        if decryption:
+            keyXor[:active] ^= newByte
+        else:
+            keyXor[:active] ^= curByte
+        block[pos, :active] = newByte
+    block = block.T.copy()
+    result = [None] * count
+    for col, i in enumerate(order):
+        result[i] = bytearray(block[col, :lengths[col]].tostring())
+    return result
+
 def checksumPid(s):
     crc = (~binascii.crc32(s,-1))&0xFFFFFFFF
     crc = crc ^ (crc >> 16)
@@ -164,132 +363,703 @@ def getSizeOfTrailingDataEntries(ptr, size, flags):
     #    num += (ord(ptr[size - num - 1]) & 0x3) + 1
     return num
 
+keyvec1 = "\x72\x38\x33\xB0\xB4\xF2\xE3\xCA\xDF\x09\x01\xD6\xE2\xE0\x3F\x96"
+
+# Look for the voucher in the DRM block data that temp_key unlocks and
+# return the book key from it
+def checkVouchers(data, count, temp_key, pid_voucher):
+    temp_key_sum = sum(map(ord,temp_key)) & 0xff
+    for i in xrange(count):
+        verification, size, type, cksum, cookie = struct.unpack('>LLLBxxx32s', data[i*0x30:i*0x30+0x30])
+        cookie = PC1Fast(temp_key, cookie)
+        ver,flags,finalkey,expiry,expiry2 = struct.unpack('>LL16sLL', cookie)
+        if verification == ver and cksum == temp_key_sum and (not pid_voucher or (flags & 0x1F) == 1):
+            return finalkey
+    return None
+
+# Find the book key in the DRM block for the first of pids (without their
+# checksum) that unlocks it. Returns that pid and the key, the pid is None
+# if only the default voucher that doesn't require a PID matched.
+def findBookKey(data, count, pids):
+    for pid in pids:
+        temp_key = PC1Fast(keyvec1, pid.ljust(16,'\0'), False)
+        found_key = checkVouchers(data, count, temp_key, True)
+        if found_key:
+            return pid, found_key
+    # Then try the default encoding that doesn't require a PID
+    found_key = checkVouchers(data, count, keyvec1, False)
+    if found_key:
+        return None, found_key
+    return None, None
+
+# Get the location of the DRM block from record 0 as (offset, count, size),
+# or None if the book is not encrypted
+def getDrmInfo(sect):
+    crypto_type, = struct.unpack('>H', sect[0xC:0xC+2])
+    if crypto_type == 0:
+        return None
+    if crypto_type == 1:
+        raise DrmException("cannot decode Mobipocket encryption type 1")
+    if crypto_type != 2:
+        raise DrmException("unknown encryption type: %d" % crypto_type)
+
+    drm_ptr, drm_count, drm_size, drm_flags = struct.unpack('>LLLL', sect[0xA8:0xA8+16])
+    if drm_count == 0:
+        raise DrmException("no PIDs found in this file")
+    return drm_ptr, drm_count, drm_size
+
+# Find out which of pids unlocks a book by looking only at its record 0.
+# Returns the PID and the book key, which can be handed to DrmStripper so
+# that only the right key is used for the full decryption. The PID is None
+# if the book uses the default key that needs no PID, and both are None if
+# the book is not encrypted.
+def probeKey(data_file, pids):
+    if data_file[0x3C:0x3C+8] != 'BOOKMOBI':
+        raise DrmException("invalid file format")
+    sections = SectionTable(data_file, len(data_file))
+    sect = sliceView(data_file, sections.start(0), sections.end(0))
+
+    drm_info = getDrmInfo(sect)
+    if drm_info is None:
+        return None, None
+    drm_ptr, drm_count, drm_size = drm_info
+    valid = []
+    for pid in pids:
+        if checksumPid(pid[0:-2]) == pid:
+            valid.append(pid[0:-2])
+    pid, found_key = findBookKey(sect[drm_ptr:drm_ptr+drm_size], drm_count, valid)
+    if not found_key:
+        raise DrmException("no key found. maybe the PID is incorrect")
+    if pid is not None:
+        pid = checksumPid(pid)
+    return pid, found_key
+
+# Size of the trailing data entries of the record from start to end of data,
+# testflags are the extra data flags shifted right by one. Same as
+# getSizeOfTrailingDataEntries, but working on offsets into the whole file.
+def getTrailingSize(data, start, end, testflags):
+    num = 0
+    while testflags:
+        if testflags & 1:
+            # the entry ends with its size, as 7 bit bytes read backwards
+            pos = end - num
+            bitpos, result = 0, 0
+            while pos > start:
+                pos -= 1
+                v = ord(data[pos])
+                result |= (v & 0x7F) << bitpos
+                bitpos += 7
+                if (v & 0x80) != 0 or (bitpos >= 28):
+                    break
+            num += result
+        testflags >>= 1
+    return num
+
+# Size of the trailing data entries of records first to last of data in one
+# pass over the section table, as an array indexed from first
+def getTrailingSizes(data, sections, first, last, flags):
+    sizes = array.array('L', [0]) * (last - first + 1)
+    testflags = flags >> 1
+    if testflags:
+        for i in xrange(first, last + 1):
+            sizes[i - first] = getTrailingSize(data, sections.start(i), sections.end(i), testflags)
+    return sizes
+
+# Decrypt one text record, leaving its extra_size bytes of trailing data
+# entries as they are. The result is written into dst at dst_off, or into a
+# new bytearray which is returned.
+def decryptRecord(key, data, extra_size, dst=None, dst_off=0):
+    size = len(data)
+    if dst is None:
+        dst = bytearray(size)
+    PC1Fast(key, data[0:size - extra_size], True, dst, dst_off)
+    if extra_size > 0:
+        dst[dst_off + size - extra_size:dst_off + size] = data[size - extra_size:]
+    return dst
+
+# Decrypt a run of consecutive text records, given as a list of their
+# data, with PC1Batch. Like decryptRecord the records are written one after
+# the other into dst at dst_off, or into a new bytearray which is returned.
+def decryptRecordBatch(key, datas, extra_sizes, dst=None, dst_off=0):
+    if dst is None:
+        dst = bytearray(sum([len(data) for data in datas]))
+    texts = []
+    for data, extra_size in zip(datas, extra_sizes):
+        texts.append(data[0:len(data) - extra_size])
+    pos = dst_off
+    for data, extra_size, text in zip(datas, extra_sizes, PC1Batch(key, texts)):
+        size = len(data)
+        dst[pos:pos + size - extra_size] = text
+        if extra_size > 0:
+            dst[pos + size - extra_size:pos + size] = data[size - extra_size:]
+        pos += size
+    return dst
+
+# Process pool worker, decrypts a run of consecutive text records. sizes
+# and extra_sizes hold the size of each record in chunk and of its trailing
+# data entries.
+def decryptChunk(args):
+    key, chunk, sizes, extra_sizes = args
+    if numpy is not None and len(sizes) >= PC1_BATCH_MIN:
+        datas = []
+        pos = 0
+        for size in sizes:
+            datas.append(sliceView(chunk, pos, pos + size))
+            pos += size
+        return str(decryptRecordBatch(key, datas, extra_sizes))
+    result = bytearray(len(chunk))
+    pos = 0
+    for size, extra_size in zip(sizes, extra_sizes):
+        decryptRecord(key, sliceView(chunk, pos, pos + size), extra_size, result, pos)
+        pos += size
+    return str(result)
+
+# Process pool worker for writing in place, decrypts a run of consecutive
+# text records starting at offset off of the book at inpath and writes them
+# at the same offset of outpath, which already has the size of the book.
+# Every worker opens the files itself, so the decrypted records never pass
+# through the parent process.
+def decryptChunkInPlace(args):
+    key, inpath, outpath, off, sizes, extra_sizes = args
+    infile = open(inpath, 'rb')
+    try:
+        infile.seek(off)
+        chunk = infile.read(sum(sizes))
+    finally:
+        infile.close()
+    if len(chunk) < sum(sizes):
+        raise DrmException("unexpected end of file")
+    data = decryptChunk((key, chunk, sizes, extra_sizes))
+    outfile = open(outpath, 'r+b')
+    try:
+        outfile.seek(off)
+        outfile.write(data)
+    finally:
+        outfile.close()
+    return len(data)
+
+# Zero copy slice of data from start to end. This is a memoryview where data
+# supports it and an old style buffer otherwise (mmap objects in Python 2).
+def sliceView(data, start, end):
+    try:
+        return memoryview(data)[start:end]
+    except TypeError:
+        return buffer(data, start, end - start)
+
+# Map a book file read only into memory, for use as the data_file
+# of a DrmStripper
+def mapFile(path):
+    f = open(path, 'rb')
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+# The section table of a PDB file. It is decoded with a single unpack into
+# arrays of the section offsets, flags and unique ids, with the file size
+# appended to the offsets so that the end of every section is a lookup too.
+# data must hold at least the header and the section table.
+class SectionTable:
+    def __init__(self, data, file_size):
+        self.num_sections, = struct.unpack('>H', data[76:78])
+        count = self.num_sections
+        if len(data) < 78 + count * 8:
+            raise DrmException("invalid file format")
+        fields = struct.unpack('>' + 'LL' * count, data[78:78 + count * 8])
+        self.offsets = array.array('L', fields[0::2])
+        self.offsets.append(file_size)
+        self.flags = array.array('B', [attr >> 24 for attr in fields[1::2]])
+        self.ids = array.array('L', [attr & 0xFFFFFF for attr in fields[1::2]])
+
+    def __len__(self):
+        return self.num_sections
+
+    def start(self, section):
+        return self.offsets[section]
+
+    def end(self, section):
+        return self.offsets[section + 1]
+
+    def size(self, section):
+        return self.offsets[section + 1] - self.offsets[section]
+
 class DrmStripper:
+    def sectionRange(self, section):
+        return self.sections.start(section), self.sections.end(section)
+
     def loadSection(self, section):
-        if (section + 1 == self.num_sections):
-            endoff = len(self.data_file)
-        else:
-            endoff = self.sections[section + 1][0]
-        off = self.sections[section][0]
-        return self.data_file[off:endoff]
+        off, endoff = self.sectionRange(section)
+        return sliceView(self.data_file, off, endoff)
+
+    # copy of the bytes from start to end, used to hand data to other processes
+    def readRange(self, start, end):
+        return self.data_file[start:end]
 
+    # patches are written in place into the mutable copy of the book
     def patch(self, off, new):
-        self.data_file = self.data_file[:off] + new + self.data_file[off+len(new):]
+        assert off + len(new) <= len(self.book)
+        self.book[off:off+len(new)] = new
 
     def patchSection(self, section, new, in_off = 0):
-        if (section + 1 == self.num_sections):
-            endoff = len(self.data_file)
-        else:
-            endoff = self.sections[section + 1][0]
-        off = self.sections[section][0]
+        off, endoff = self.sectionRange(section)
         assert off + in_off + len(new) <= endoff
         self.patch(off + in_off, new)
 
     def parseDRM(self, data, count, pid):
-        pid = pid.ljust(16,'\0')
-        keyvec1 = "\x72\x38\x33\xB0\xB4\xF2\xE3\xCA\xDF\x09\x01\xD6\xE2\xE0\x3F\x96"
-        temp_key = PC1(keyvec1, pid, False)
-        temp_key_sum = sum(map(ord,temp_key)) & 0xff
-        found_key = None
-        for i in xrange(count):
-            verification, size, type, cksum, cookie = struct.unpack('>LLLBxxx32s', data[i*0x30:i*0x30+0x30])
-            cookie = PC1(temp_key, cookie)
-            ver,flags,finalkey,expiry,expiry2 = struct.unpack('>LL16sLL', cookie)
-            if verification == ver and cksum == temp_key_sum and (flags & 0x1F) == 1:
-                found_key = finalkey
-                break
-        if not found_key:
-            # Then try the default encoding that doesn't require a PID
-            temp_key = keyvec1
-            temp_key_sum = sum(map(ord,temp_key)) & 0xff
-            for i in xrange(count):
-                verification, size, type, cksum, cookie = struct.unpack('>LLLBxxx32s', data[i*0x30:i*0x30+0x30])
-                cookie = PC1(temp_key, cookie)
-                ver,flags,finalkey,expiry,expiry2 = struct.unpack('>LL16sLL', cookie)
-                if verification == ver and cksum == temp_key_sum:
-                    found_key = finalkey
-                    break
-        return found_key
+        return findBookKey(data, count, [pid])[1]
 
-    def __init__(self, data_file, pid):
+    def checkPid(self, pid):
         if checksumPid(pid[0:-2]) != pid:
             raise DrmException("invalid PID checksum")
-        pid = pid[0:-2]
+        return pid[0:-2]
 
-        self.data_file = data_file
-        header = data_file[0:72]
+    # parse the PDB header and section table, data must hold at least
+    # 78 + 8 * num_sections bytes from the start of the file
+    def parseHeader(self, data):
+        header = data[0:72]
         if header[0x3C:0x3C+8] != 'BOOKMOBI':
             raise DrmException("invalid file format")
-        self.num_sections, = struct.unpack('>H', data_file[76:78])
+        self.sections = SectionTable(data, self.file_size)
+        self.num_sections = len(self.sections)
 
-        self.sections = []
-        for i in xrange(self.num_sections):
-            offset, a1,a2,a3,a4 = struct.unpack('>LBBBB', data_file[78+i*8:78+i*8+8])
-            flags, val = a1, a2<<16|a3<<8|a4
-            self.sections.append( (offset, flags, val) )
+    # Progress is reported in phases: 'header', 'key', 'decrypt' and
+    # 'write'. The progress callback is called as progress(phase, done,
+    # total, bytes, elapsed) with the records (or other steps) done out of
+    # total, the bytes processed and the seconds spent so far in the phase.
+    def startPhase(self, phase):
+        self.phase = phase
+        self.phase_start = time.time()
 
-        sect = self.loadSection(0)
-        records, = struct.unpack('>H', sect[0x8:0x8+2])
+    def report(self, done, total, nbytes):
+        if self.progress is not None:
+            self.progress(self.phase, done, total, nbytes, time.time() - self.phase_start)
+
+    # parse the MOBI header in record 0 and find the book key, unless it
+    # is already known, sets found_key to None if the book is not encrypted
+    def parseRecord0(self, sect, pid):
+        self.records, = struct.unpack('>H', sect[0x8:0x8+2])
         mobi_length, = struct.unpack('>L',sect[0x14:0x18])
         mobi_version, = struct.unpack('>L',sect[0x68:0x6C])
-        extra_data_flags = 0
-        print "MOBI header version = %d, length = %d" %(mobi_version, mobi_length)
+        self.extra_data_flags = 0
+        log.info("MOBI header version = %d, length = %d", mobi_version, mobi_length)
         if (mobi_length >= 0xE4) and (mobi_version >= 5):
-            extra_data_flags, = struct.unpack('>H', sect[0xF2:0xF4])
-            print "Extra Data Flags = %d" %extra_data_flags
+            self.extra_data_flags, = struct.unpack('>H', sect[0xF2:0xF4])
+            log.info("Extra Data Flags = %d", self.extra_data_flags)
+        self.report(1, 1, self.sections.start(0) + len(sect))
 
-        crypto_type, = struct.unpack('>H', sect[0xC:0xC+2])
-        if crypto_type == 0:
-            print "This book is not encrypted."
+        self.found_key = None
+        drm_info = getDrmInfo(sect)
+        if drm_info is None:
+            log.info("This book is not encrypted.")
         else:
-            if crypto_type == 1:
-                raise DrmException("cannot decode Mobipocket encryption type 1")
-            if crypto_type != 2:
-                raise DrmException("unknown encryption type: %d" % crypto_type)
-
             # calculate the keys
-            drm_ptr, drm_count, drm_size, drm_flags = struct.unpack('>LLLL', sect[0xA8:0xA8+16])
-            if drm_count == 0:
-                raise DrmException("no PIDs found in this file")
-            found_key = self.parseDRM(sect[drm_ptr:drm_ptr+drm_size], drm_count, pid)
+            self.startPhase('key')
+            drm_ptr, drm_count, drm_size = drm_info
+            found_key = self.book_key
+            if not found_key and self.key_cache is not None:
+                found_key = self.key_cache.get("mobi", sect)
+            if not found_key:
+                found_key = self.parseDRM(sect[drm_ptr:drm_ptr+drm_size], drm_count, pid)
+                if found_key and self.key_cache is not None:
+                    self.key_cache.put("mobi", sect, found_key)
             if not found_key:
                 raise DrmException("no key found. maybe the PID is incorrect")
+            self.found_key = found_key
+            self.drm_ptr, self.drm_size = drm_ptr, drm_size
+            self.report(1, 1, drm_size)
+
+    def stripRecord0(self):
+        # kill the drm keys
+        self.patchSection(0, "\0" * self.drm_size, self.drm_ptr)
+        # kill the drm pointers
+        self.patchSection(0, "\xff" * 4 + "\0" * 12, 0xA8)
+        # clear the crypto type
+        self.patchSection(0, "\0" * 2, 0xC)
+
+    # size of the trailing data entries of records first to last
+    def planTrailingSizes(self, first, last):
+        return getTrailingSizes(self.data_file, self.sections, first, last, self.extra_data_flags)
+
+    # Whether the serial decrypt loop plans the trailing data entry sizes
+    # of all records first. Where records are read from a file that takes
+    # an extra pass over it, their sizes are then taken from each record as
+    # it is loaded instead.
+    plan_serial = True
+
+    # size of the trailing data entries of the text record section, from
+    # the plan or from its data if there is none
+    def trailingSize(self, section, data):
+        if self.trailing_sizes is not None:
+            return self.trailing_sizes[section-1]
+        return getTrailingSize(data, 0, len(data), self.extra_data_flags >> 1)
 
-            # kill the drm keys
-            self.patchSection(0, "\0" * drm_size, drm_ptr)
-            # kill the drm pointers
-            self.patchSection(0, "\xff" * 4 + "\0" * 12, 0xA8)
-            # clear the crypto type
-            self.patchSection(0, "\0" * 2, 0xC)
+    # decrypt a text record, into dst at the record's offset if given
+    def decryptSection(self, section, dst=None):
+        data = self.loadSection(section)
+        extra_size = self.trailingSize(section, data)
+        if dst is None:
+            return decryptRecord(self.found_key, data, extra_size)
+        decryptRecord(self.found_key, data, extra_size, dst, self.sections.start(section))
+
+    # decrypt text records first to last in lockstep, into dst at their
+    # offsets if given
+    def decryptSections(self, first, last, dst=None):
+        datas = [self.loadSection(i) for i in xrange(first, last+1)]
+        extra_sizes = [self.trailingSize(i, datas[i-first]) for i in xrange(first, last+1)]
+        if dst is None:
+            return decryptRecordBatch(self.found_key, datas, extra_sizes)
+        decryptRecordBatch(self.found_key, datas, extra_sizes, dst, self.sections.start(first))
+
+    # split the text records into runs of consecutive records of about
+    # chunk_size bytes, returns a list of (first, last) record numbers
+    def recordChunks(self, chunk_size):
+        chunks = []
+        first = 1
+        while first <= self.records:
+            start = self.sections.start(first)
+            last = first
+            while last < self.records and self.sections.end(last) - start < chunk_size:
+                last += 1
+            chunks.append((first, last))
+            first = last + 1
+        return chunks
+
+    # Only books with enough text are decrypted on a process pool
+    def usePool(self):
+        if self.processes < 2 or self.records == 0:
+            return False
+        text_size = self.sections.end(self.records) - self.sections.start(1)
+        return text_size >= self.parallel_threshold
+
+    # the runs of records handed to the pool, a few per process
+    def poolChunks(self):
+        text_size = self.sections.end(self.records) - self.sections.start(1)
+        chunk_size = min(max(text_size // (self.processes * 4), 1 << 16), 4 << 20)
+        return self.recordChunks(chunk_size)
+
+    # Generator decrypting the text records in order. Yields the number of
+    # the last record done and the decrypted data, which is a single record
+    # when running serially and a run of records when running on a pool.
+    # If dst is given the records are written into it at their offsets in
+    # the file instead and the data yielded is None.
+    def decryptRecords(self, dst=None):
+        self.startPhase('decrypt')
+        self.report(0, self.records, 0)
+        if self.records == 0:
+            return
+        # plan the work first, trailing_sizes[i-1] is the size of the
+        # trailing data entries of record i
+        self.trailing_sizes = None
+        if self.plan_serial or self.usePool():
+            self.trailing_sizes = self.planTrailingSizes(1, self.records)
+        start = self.sections.start(1)
+        if not self.usePool() and numpy is not None and self.records >= PC1_BATCH_MIN:
+            for first in xrange(1, self.records+1, PC1_BATCH):
+                last = min(first + PC1_BATCH - 1, self.records)
+                data = self.decryptSections(first, last, dst)
+                self.report(last, self.records, self.sections.end(last) - start)
+                yield last, data
+            return
+        if not self.usePool():
+            for i in xrange(1, self.records+1):
+                data = self.decryptSection(i, dst)
+                self.report(i, self.records, self.sections.end(i) - start)
+                yield i, data
+            return
+
+        # Records are independent of each other, so hand out runs of them to
+        # the pool. Only a few runs per process are in flight at a time to
+        # keep memory bounded when streaming.
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            pending = collections.deque()
+            for first, last in self.poolChunks():
+                off = self.sections.start(first)
+                sizes = []
+                for i in xrange(first, last+1):
+                    sizes.append(self.sections.size(i))
+                extra_sizes = self.trailing_sizes[first-1:last]
+                chunk = self.readRange(off, off + sum(sizes))
+                job = (self.found_key, chunk, sizes, extra_sizes)
+                pending.append((off, last, pool.apply_async(decryptChunk, (job,))))
+                if len(pending) >= 2 * self.processes:
+                    yield self.collectChunk(pending.popleft(), dst)
+            while pending:
+                yield self.collectChunk(pending.popleft(), dst)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def collectChunk(self, job, dst):
+        off, last, result = job
+        data = result.get()
+        self.report(last, self.records, self.sections.end(last) - self.sections.start(1))
+        if dst is None:
+            return last, data
+        dst[off:off+len(data)] = data
+        return last, None
+
+    # data_file can be a string or a memory mapped file (see mapFile).
+    # Sections are handed out as zero copy views of it, so only the
+    # records that are decrypted get copied.
+    #
+    # With processes > 1 books with at least parallel_threshold bytes of
+    # text records are decrypted on a pool of that many processes.
+    #
+    # If the book key is already known (see probeKey) it can be passed as
+    # book_key, pid is not used then. A key_cache (see keycache.KeyCache)
+    # is asked for the key before it is looked for in the DRM vouchers.
+    #
+    # progress is an optional callback, see startPhase.
+    def __init__(self, data_file, pid, processes=0, parallel_threshold=PARALLEL_THRESHOLD, book_key=None, key_cache=None, progress=None):
+        self.book_key = book_key
+        self.key_cache = key_cache
+        self.progress = progress
+        if book_key is None:
+            pid = self.checkPid(pid)
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+
+        self.startPhase('header')
+        self.data_file = data_file
+        self.file_size = len(data_file)
+        self.parseHeader(data_file)
+        self.parseRecord0(self.loadSection(0), pid)
+
+        if self.found_key:
+            # The decrypted book is built in a single preallocated buffer.
+            # Record 0 is patched in place and the text records are
+            # decrypted straight into their final position.
+            end0 = self.sections.end(0)
+            self.book = bytearray(self.file_size)
+            self.book[0:end0] = sliceView(self.data_file, 0, end0)
+            self.stripRecord0()
 
             # decrypt sections
-            print "Decrypting. Please wait . . .",
-            new_data = self.data_file[:self.sections[1][0]]
-            for i in xrange(1, records+1):
-                data = self.loadSection(i)
-                extra_size = getSizeOfTrailingDataEntries(data, len(data), extra_data_flags)
-                if i%100 == 0:
-                    print ".",
-                # print "record %d, extra_size %d" %(i,extra_size)
-                new_data += PC1(found_key, data[0:len(data) - extra_size])
-                if extra_size > 0:
-                    new_data += data[-extra_size:]
-                #self.patchSection(i, PC1(found_key, data[0:len(data) - extra_size]))
-            if self.num_sections > records+1:
-                new_data += self.data_file[self.sections[records+1][0]:]
-            self.data_file = new_data
-            print "done"
+            for last, data in self.decryptRecords(self.book):
+                pass
+            self.startPhase('write')
+            start = self.sections.start(self.records+1)
+            if self.num_sections > self.records+1:
+                self.book[start:] = sliceView(self.data_file, start, self.file_size)
+            self.data_file = self.book
+            self.report(1, 1, self.file_size - start)
 
+    # The decrypted book as a bytearray, or data_file itself if the book
+    # was not encrypted
     def getResult(self):
         return self.data_file
 
+# Copy the bytes from start to end of infile into outfile a block at a time
+def copyRange(infile, outfile, start, end, blocksize=1<<20):
+    infile.seek(start)
+    while start < end:
+        block = infile.read(min(blocksize, end - start))
+        if not block:
+            raise DrmException("unexpected end of file")
+        outfile.write(block)
+        start += len(block)
+
+# Streaming variant of DrmStripper. Only the header and record 0 are read
+# when it is created, writeResult() then decrypts one record at a time
+# straight into the output. infile and outfile can be paths or open files.
+#
+# When both are paths and the book is decrypted on a process pool, the
+# output file is written in place instead: PC1 keeps the length of the
+# records, so every record has the same offset in both files and the pool
+# workers write their runs of records straight to their final offset.
+class StreamingDrmStripper(DrmStripper):
+    def __init__(self, infile, pid, processes=0, parallel_threshold=PARALLEL_THRESHOLD, book_key=None, key_cache=None, progress=None):
+        self.book_key = book_key
+        self.key_cache = key_cache
+        self.progress = progress
+        if book_key is None:
+            pid = self.checkPid(pid)
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+
+        self.startPhase('header')
+        self.path = None
+        if isinstance(infile, basestring):
+            self.path = infile
+            infile = open(infile, 'rb')
+        self.infile = infile
+        try:
+            infile.seek(0, 2)
+            self.file_size = infile.tell()
+            infile.seek(0)
+            header = infile.read(78)
+            if len(header) < 78:
+                raise DrmException("invalid file format")
+            num_sections, = struct.unpack('>H', header[76:78])
+            self.parseHeader(header + infile.read(num_sections * 8))
+
+            # the header and record 0 are read from the file once and kept in
+            # memory, that is the only part of the book that gets patched
+            end0 = self.sections.end(0)
+            self.book = bytearray(self.readRange(0, end0))
+            self.parseRecord0(sliceView(self.book, self.sections.start(0), end0), pid)
+
+            if self.found_key:
+                self.stripRecord0()
+        except:
+            self.close()
+            raise
+
+    def loadSection(self, section):
+        off, endoff = self.sectionRange(section)
+        return self.readRange(off, endoff)
+
+    def readRange(self, start, end):
+        self.infile.seek(start)
+        data = self.infile.read(end - start)
+        if len(data) < end - start:
+            raise DrmException("unexpected end of file")
+        return data
+
+    # The records are read one after the other when decrypting serially,
+    # so the trailing sizes are only planned for the pool
+    plan_serial = False
+
+    # Only the last few bytes of each record are read for planning. If the
+    # entries could reach past them the whole record is read instead.
+    def planTrailingSizes(self, first, last):
+        sizes = array.array('L', [0]) * (last - first + 1)
+        testflags = self.extra_data_flags >> 1
+        if not testflags:
+            return sizes
+        entries = bin(testflags).count('1')
+        for i in xrange(first, last + 1):
+            start, end = self.sectionRange(i)
+            window = min(end - start, 64)
+            num = getTrailingSize(self.readRange(end - window, end), 0, window, testflags)
+            if num + 4 * entries >= window and window < end - start:
+                num = getTrailingSize(self.loadSection(i), 0, end - start, testflags)
+            sizes[i - first] = num
+        return sizes
+
+    # outfile can be the path of the input itself, the book is then written
+    # to a temporary file next to it that replaces it once it is complete.
+    # If writing fails the partial output file is removed.
+    def writeResult(self, outfile):
+        if not isinstance(outfile, basestring):
+            self.writeStream(outfile)
+            return
+
+        target = outfile
+        if self.isInput(target):
+            fd, outfile = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(target)))
+            os.close(fd)
+            shutil.copymode(target, outfile)
+        try:
+            if self.path is not None and self.found_key and self.usePool():
+                self.writeInPlace(outfile)
+            else:
+                out = open(outfile, 'wb')
+                try:
+                    self.writeStream(out)
+                finally:
+                    out.close()
+            if outfile != target:
+                if os.name == "nt":
+                    # open files can't be replaced on Windows
+                    self.close()
+                    os.remove(target)
+                os.rename(outfile, target)
+        except:
+            if os.path.exists(outfile):
+                os.remove(outfile)
+            raise
+
+    # whether path is the book being read
+    def isInput(self, path):
+        inpath = self.path or getattr(self.infile, 'name', None)
+        if not isinstance(inpath, basestring) or not os.path.exists(inpath) or not os.path.exists(path):
+            return False
+        if not hasattr(os.path, 'samefile'):
+            # not available on Windows
+            return os.path.normcase(os.path.abspath(inpath)) == os.path.normcase(os.path.abspath(path))
+        return os.path.samefile(inpath, path)
+
+    def writeStream(self, outfile):
+        outfile.write(self.book)
+        start = len(self.book)
+        if self.found_key:
+            for last, data in self.decryptRecords():
+                outfile.write(data)
+            start = self.sections.start(self.records+1)
+        self.startPhase('write')
+        copyRange(self.infile, outfile, start, self.file_size)
+        self.report(1, 1, len(self.book) + self.file_size - start)
+
+    # Write everything but the text records to outpath, which gets the size
+    # of the book, and have the pool decrypt the text records into it
+    def writeInPlace(self, outpath):
+        self.startPhase('write')
+        outfile = open(outpath, 'wb')
+        try:
+            outfile.write(self.book)
+            start = self.sections.start(self.records+1)
+            outfile.seek(start)
+            copyRange(self.infile, outfile, start, self.file_size)
+            outfile.truncate(self.file_size)
+        finally:
+            outfile.close()
+        self.report(1, 1, len(self.book) + self.file_size - start)
+
+        self.startPhase('decrypt')
+        self.report(0, self.records, 0)
+        self.trailing_sizes = self.planTrailingSizes(1, self.records)
+        chunks = self.poolChunks()
+        jobs = []
+        for first, last in chunks:
+            sizes = []
+            for i in xrange(first, last+1):
+                sizes.append(self.sections.size(i))
+            extra_sizes = self.trailing_sizes[first-1:last]
+            jobs.append((self.found_key, self.path, outpath, self.sections.start(first), sizes, extra_sizes))
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            done = 0
+            for (first, last), size in zip(chunks, pool.imap(decryptChunkInPlace, jobs)):
+                done += size
+                self.report(last, self.records, done)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    # Close the input file if it was opened from a path, files passed in
+    # are left to the caller
+    def close(self):
+        if self.path is not None:
+            self.infile.close()
+
+# Progress callback printing the heartbeat of dots while decrypting
+class DotProgress:
+    def __init__(self):
+        self.dots = -1
+
+    def __call__(self, phase, done, total, nbytes, elapsed):
+        if phase != 'decrypt':
+            return
+        if self.dots < 0:
+            print "Decrypting. Please wait . . .",
+            self.dots = 0
+        while self.dots < done // 100:
+            print ".",
+            self.dots += 1
+        if done == total:
+            print "done"
+
 if __name__ == "__main__":
     sys.stdout=Unbuffered(sys.stdout)
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
     print ('MobiDeDrm v%(__version__)s. '
        'Copyright 2008-2010 The Dark Reverser.' % globals())
     
     parser = OptionParser("Usage: %prog [options] input.azw output.mobi PID", version=__version__)
     parser.add_option("-s", "--serial", dest="serial", default="", help="Get the PID from a Kindle or Kindle for iPhone serial number")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=0, help="Decrypt large books on a pool of JOBS processes")
     
     options, args = parser.parse_args()
     
@@ -305,10 +1075,12 @@ if __name__ == "__main__":
         infile = args[1]
         outfile = args[2]
         pid = args[3]
-        data_file = file(infile, 'rb').read()
         try:
-            strippedFile = DrmStripper(data_file, pid)
-            file(outfile, 'wb').write(strippedFile.getResult())
+            strippedFile = StreamingDrmStripper(infile, pid, options.jobs, progress=DotProgress())
+            try:
+                strippedFile.writeResult(outfile)
+            finally:
+                strippedFile.close()
         except DrmException, e:
             print "Error: %s" % e
             sys.exit(1)
@@ -329,11 +1101,14 @@ elif "calibre" in globals():
             from calibre.gui2 import is_ok_to_use_qt
             from PyQt4.Qt import QMessageBox
             PID = self.site_customization
-            data_file = file(path_to_ebook, 'rb').read()
-            ar = PID.split(',')
-            for i in ar:
+            data_file = mapFile(path_to_ebook)
+            try:
                 try:
-                    unlocked_file = DrmStripper(data_file, i).getResult()
+                    # find the PID that unlocks the book before decrypting it
+                    pid, key = probeKey(data_file, PID.split(','))
+                    if key is None:
+                        return path_to_ebook
+                    unlocked_file = DrmStripper(data_file, pid, book_key=key).getResult()
                 except DrmException:
                     # ignore the error
                     pass
@@ -342,6 +1117,9 @@ elif "calibre" in globals():
                     of.write(unlocked_file)
                     of.close()
                     return of.name
+            finally:
+                # don't keep the book mapped, calibre may move or delete it
+                data_file.close()
             if is_ok_to_use_qt():
                 d = QMessageBox(QMessageBox.Warning, "MobiDeDRM Plugin", "Couldn't decode: %s\n\nImporting encrypted version." % path_to_ebook)
                 d.show()
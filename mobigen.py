@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+"""
+    Generator of synthetic encrypted Mobipocket books, for testing and
+    benchmarking without real purchased books. The books are encrypted with
+    a random book key behind DRM vouchers that unlock with the PID of a test
+    Kindle serial number, so mobidedrm can decrypt them like real books.
+
+    The text records are random data, the output of a generator run is
+    fully determined by its seed.
+"""
+
+import os
+import random
+import struct
+
+from optparse import OptionParser
+
+import mobidedrm
+
+SERIAL = "B001A0B0C0D0E0F0"
+
+def random_bytes(rnd, size):
+    """
+        Return size random bytes taken from the random.Random rnd.
+    """
+    if size == 0:
+        return ""
+    return ("%0*x" % (size * 2, rnd.getrandbits(size * 8))).decode("hex")
+
+def encode_size(size):
+    """
+        Encode the size of a trailing data entry, as it is stored in the
+        last bytes of the entry.
+    """
+    data = [size & 0x7F]
+    size >>= 7
+    while size:
+        data.insert(0, size & 0x7F)
+        size >>= 7
+    data[0] |= 0x80
+    return "".join([chr(c) for c in data])
+
+def multibyte_entry(rnd):
+    """
+        Return a multibyte trailing entry, which ends with its size - 1 in
+        the low two bits. It is encrypted along with the text.
+    """
+    count = rnd.randint(0, 3)
+    return random_bytes(rnd, count) + chr(count)
+
+def trailing_entries(rnd, flags, max_size=32):
+    """
+        Return the trailing data entries of random sizes that follow the
+        encrypted part of a text record, one for each bit of the extra data
+        flags but the lowest.
+    """
+    data = ""
+    for bit in xrange(bin(flags >> 1).count("1")):
+        size = rnd.randint(1, max_size)
+        size = max(size, len(encode_size(size)))
+        tail = encode_size(size)
+        data += random_bytes(rnd, size - len(tail)) + tail
+    return data
+
+def make_vouchers(rnd, pid, book_key):
+    """
+        Return the DRM block of record 0 for the PID (without checksum) and
+        its number of vouchers. A decoy voucher comes before the real one.
+    """
+    temp_key = mobidedrm.PC1Fast(mobidedrm.keyvec1, pid.ljust(16, "\0"), False)
+    temp_key_sum = sum(map(ord, temp_key)) & 0xff
+    verification = rnd.getrandbits(32)
+    cookie = struct.pack(">LL16sLL", verification, 1, book_key, 0, 0)
+    vouchers = struct.pack(">LLLBxxx32s", verification ^ 1, 0x30, 1,
+                           (temp_key_sum + 1) & 0xff, random_bytes(rnd, 32))
+    vouchers += struct.pack(">LLLBxxx32s", verification, 0x30, 1,
+                            temp_key_sum, mobidedrm.PC1Fast(temp_key, cookie, False))
+    return vouchers, 2
+
+def make_book(serial=SERIAL, records=100, record_size=4096,
+              mobi_version=6, mobi_length=0xE8, extra_data_flags=0x3,
+              other_sections=5, encrypt=True, seed=0):
+    """
+        Return a synthetic Mobipocket book as a string.
+
+        The book has the given number of text records of between half and
+        all of record_size bytes each, followed by other_sections sections
+        of images and such. Extra data flags are only used by the Mobi
+        header versions and lengths that have them. If encrypt is set the
+        book can be decrypted with the PID of the Kindle serial number.
+    """
+    rnd = random.Random(seed)
+    book_key = random_bytes(rnd, 16)
+    pid = mobidedrm.getPid(serial)[:-2]
+
+    if not (mobi_length >= 0xE4 and mobi_version >= 5):
+        extra_data_flags = 0
+    sections = []
+    for i in xrange(records):
+        text = random_bytes(rnd, rnd.randint(record_size // 2, record_size))
+        if extra_data_flags & 1:
+            text += multibyte_entry(rnd)
+        if encrypt:
+            text = mobidedrm.PC1Fast(book_key, text, False)
+        sections.append(text + trailing_entries(rnd, extra_data_flags))
+    for i in xrange(other_sections):
+        sections.append(random_bytes(rnd, rnd.randint(1 << 10, 64 << 10)))
+
+    if encrypt:
+        vouchers, voucher_count = make_vouchers(rnd, pid, book_key)
+    else:
+        vouchers, voucher_count = "", 0
+    record0 = bytearray(0x100 + len(vouchers))
+    struct.pack_into(">H", record0, 0, 1)
+    struct.pack_into(">H", record0, 0x8, records)
+    struct.pack_into(">H", record0, 0xC, 2 if encrypt else 0)
+    record0[0x10:0x14] = "MOBI"
+    struct.pack_into(">L", record0, 0x14, mobi_length)
+    struct.pack_into(">L", record0, 0x68, mobi_version)
+    if encrypt:
+        struct.pack_into(">LLLL", record0, 0xA8, 0x100, voucher_count, len(vouchers), 0)
+    else:
+        struct.pack_into(">LLLL", record0, 0xA8, 0xFFFFFFFF, 0, 0, 0)
+    if extra_data_flags:
+        struct.pack_into(">H", record0, 0xF2, extra_data_flags)
+    record0[0x100:] = vouchers
+    sections.insert(0, str(record0))
+
+    header = bytearray(78)
+    header[0:8] = "testbook"
+    header[0x3C:0x44] = "BOOKMOBI"
+    struct.pack_into(">H", header, 76, len(sections))
+    offset = 78 + 8 * len(sections) + 2
+    table = []
+    for i, section in enumerate(sections):
+        table.append(struct.pack(">LL", offset, 2 * i))
+        offset += len(section)
+    return str(header) + "".join(table) + "\0\0" + "".join(sections)
+
+# (name, keyword arguments of make_book) of the books in a corpus
+CORPUS = [
+    ("small-v6", dict(records=50)),
+    ("medium-v6", dict(records=1000)),
+    ("large-v6", dict(records=5000)),
+    ("medium-v5-e4", dict(records=1000, mobi_version=5, mobi_length=0xE4, extra_data_flags=0x7)),
+    ("medium-v4", dict(records=1000, mobi_version=4, mobi_length=0xE4)),
+    ("medium-noflags", dict(records=1000, extra_data_flags=0)),
+]
+
+def make_corpus(directory, serial=SERIAL, scale=1.0):
+    """
+        Write the books of the corpus to directory, with their number of
+        text records multiplied by scale. Returns the paths of the books.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = []
+    for seed, (name, args) in enumerate(CORPUS):
+        args = dict(args)
+        args["records"] = max(1, int(args["records"] * scale))
+        path = os.path.join(directory, name + ".azw")
+        open(path, "wb").write(make_book(serial, seed=seed, **args))
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    parser = OptionParser("usage: %prog [options] directory")
+    parser.add_option("-s", "--serial", default=SERIAL,
+                      help="Kindle serial number the books are for [%default]")
+    parser.add_option("-x", "--scale", type="float", default=1.0,
+                      help="Multiply the size of the books by SCALE")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("no output directory given")
+
+    print "PID: %s" % mobidedrm.getPid(options.serial)
+    for path in make_corpus(args[0], options.serial, options.scale):
+        print "%s: %d bytes" % (path, os.path.getsize(path))
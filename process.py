@@ -8,42 +8,44 @@
     with e.g. wxWidgets.
 """
 
+import keycache
 import mobidedrm
 import multiprocessing
-import os
-import shutil
-import tempfile
 import time
 import topaz
 
 multiprocessing.freeze_support()
 
-def _process(infile, outfile, pid, error):
+def _process(infile, outfile, pid, error, processes=0, cache=None):
     try:
+        key_cache = None
+        if cache:
+            key_cache = keycache.KeyCache(cache)
+        
         if outfile.endswith(".mobi"):
             # Mobi file
-            data_file = open(infile, "rb").read()
-            strippedFile = mobidedrm.DrmStripper(data_file, pid)
-            file(outfile, 'wb').write(strippedFile.getResult())
+            strippedFile = mobidedrm.StreamingDrmStripper(infile, pid, processes, key_cache=key_cache)
+            try:
+                strippedFile.writeResult(outfile)
+            finally:
+                strippedFile.close()
         else:
             # Topaz file
-            tmp = tempfile.mkdtemp()
-            args = ['./cmbtc.py', '-v', '-p', pid[:8], '-d', '-o', tmp, infile]
-            topaz.cmbtc.main(argv=args)
-            topaz.gensvg.main(['./gensvg.py', tmp])
-            topaz.genhtml.main(['./genhtml.py', tmp])
-            
-            if not os.path.exists(outfile):
-                os.mkdir(outfile)
-                
-            for filename in ["img", "style.css", "book.html"]:
-                shutil.move(os.path.join(tmp, filename), os.path.join(outfile, filename))
-            
-            shutil.rmtree(tmp)
+            book = topaz.cmbtc.TopazBook(infile)
+            try:
+                book.key = topaz.cmbtc.findBookKey(book, [pid[:8]], key_cache)
+                if book.key is None:
+                    raise topaz.cmbtc.CMBDTCFatal("Book key could not be found. Maybe this book is not registered with this device.")
+                topaz.genbook.convertBook(book, outfile, processes=processes)
+            finally:
+                book.close()
+        
+        if key_cache:
+            key_cache.save()
     except Exception, e:
         error.value = str(e)
 
-def decrypt(infile, outfile, pid):
+def decrypt(infile, outfile, pid, processes=0, cache=None):
     """
         Decrypt a Kindle book in a different process. This periodically yields
         so that status information can be shown. Use like:
@@ -53,11 +55,16 @@ def decrypt(infile, outfile, pid):
             >>> if error:
             >>>     print error
         
+        Large Mobipocket books, and the records of Topaz books, are
+        decrypted on a pool of processes if processes is greater than one.
+        If cache is the path of a key cache (see keycache.py) book keys are
+        remembered there, so books that were processed before don't need
+        their key looked up again.
     """
     error = None
     
     errorobj = multiprocessing.Array("c", 512)
-    proc = multiprocessing.Process(target=_process, args=(infile, outfile, pid, errorobj))
+    proc = multiprocessing.Process(target=_process, args=(infile, outfile, pid, errorobj, processes, cache))
     proc.start()
     while proc.is_alive():
         yield ""
@@ -1,3 +1,4 @@
 import cmbtc
 import gensvg
 import genhtml
+import genbook
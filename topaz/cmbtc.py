@@ -13,26 +13,38 @@ class Unbuffered:
 import sys
 sys.stdout=Unbuffered(sys.stdout)
 
+import collections
 import csv
+import multiprocessing
 import os
 import getopt
+import mmap
 import zlib
 from struct import pack
 from struct import unpack
+from multiprocessing.pool import ThreadPool
+
+# local routines
+from cursor import Cursor
 
 MAX_PATH = 255
 
+# Records that are at least this large once decompressed are streamed to
+# their destination in blocks of STREAM_CHUNK bytes instead of being read
+# whole (see TopazBook.write_record)
+STREAM_THRESHOLD = 4 << 20
+STREAM_CHUNK = 256 << 10
+
+# How far ahead of the records being extracted the book is read when it is
+# read from start to end (see TopazBook.iter_records)
+READ_AHEAD = 8 << 20
+
 # Put the first 8 characters of your Kindle PID here
 # or supply it with the -p option in the command line
 ####################################################
 kindlePID = "12345678"
 ####################################################
 
-global bookFile
-global bookPayloadOffset
-global bookHeaderRecords
-global bookMetadata
-global bookKey
 global command
 
 #
@@ -56,27 +68,14 @@ def openBook(path):
         raise CMBDTCFatal("Could not open book file: " + path)
 
 #
-# Get a 7 bit encoded number from the book file
+# Get a 7 bit encoded number at the position of the cursor cur
 #
 
-def bookReadEncodedNumber():
-    flag = False
-    data = ord(bookFile.read(1))
-    
-    if data == 0xFF:
-       flag = True
-       data = ord(bookFile.read(1))
-       
-    if data >= 0x80:
-        datax = (data & 0x7F)
-        while data >= 0x80 :
-            data = ord(bookFile.read(1))
-            datax = (datax <<7) + (data & 0x7F)
-        data = datax 
-    
-    if flag:
-       data = -data
-    return data
+def readEncodedNumber(cur):
+    value = cur.read_number()
+    if value == None:
+        raise IndexError("Number past the end of the book")
+    return value
     
 #
 # Encode a number in 7 bit format
@@ -108,12 +107,14 @@ def encodeNumber(number):
    return result[::-1]
   
 #
-# Get a length prefixed string from the file 
+# Get a length prefixed string at the position of the cursor cur
 #
 
-def bookReadString():
-    stringLength = bookReadEncodedNumber()
-    return unpack(str(stringLength)+"s",bookFile.read(stringLength))[0]  
+def readString(cur):
+    value = cur.read_string()
+    if value == None:
+        raise CMBDTCFatal("Parse Error : String past the end of the book")
+    return value
     
 #
 # Returns a length prefixed string
@@ -122,117 +123,311 @@ def bookReadString():
 def lengthPrefixString(data):
     return encodeNumber(len(data))+data
     
-
-#
-# Read and return the data of one header record at the current book file position [[offset,decompressedLength,compressedLength],...]
-#
-    
-def bookReadHeaderRecordData():
-    nbValues = bookReadEncodedNumber()
-    values = []
-    for i in range (0,nbValues):
-        values.append([bookReadEncodedNumber(),bookReadEncodedNumber(),bookReadEncodedNumber()])
-    return values
-   
 #
-# Read and parse one header record at the current book file position and return the associated data [[offset,decompressedLength,compressedLength],...]
+# A Topaz book. The book file is memory mapped and its header and metadata
+# are parsed when it is opened, records are then read with get_record().
+# Nothing is changed after the book key is set, so several threads can
+# read records of the same book at once, and a process can have any
+# number of books open.
 #
 
-def parseTopazHeaderRecord():
-    if ord(bookFile.read(1)) != 0x63:
-        raise CMBDTCFatal("Parse Error : Invalid Header")
+class TopazBook(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = openBook(path)
+        self.key = None
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            # empty files can't be mapped
+            self.file.close()
+            raise CMBDTCFatal("Parse Error : Invalid Header, not a Topaz file")
+        
+        try:
+            self.parse_header()
+            self.parse_metadata()
+        except IndexError:
+            self.close()
+            raise CMBDTCFatal("Parse Error : Book is truncated")
+        except CMBDTCFatal:
+            self.close()
+            raise
     
-    tag = bookReadString()
-    record = bookReadHeaderRecordData()
-    return [tag,record]
-
-#
-# Parse the header of a Topaz file, get all the header records and the offset for the payload
-#
- 
-def parseTopazHeader():
-    global bookHeaderRecords
-    global bookPayloadOffset
-    magic = unpack("4s",bookFile.read(4))[0]
+    #
+    # Parse the header of the book, get all the header records
+    # {name: [[offset,decompressedLength,compressedLength],...]} and the
+    # offset for the payload
+    #
     
-    if magic != 'TPZ0':
-        raise CMBDTCFatal("Parse Error : Invalid Header, not a Topaz file")
+    def parse_header(self):
+        data = self.data
+        if data[0:4] != 'TPZ0':
+            raise CMBDTCFatal("Parse Error : Invalid Header, not a Topaz file")
         
-    nbRecords = bookReadEncodedNumber()
-    bookHeaderRecords = {}
-   
-    for i in range (0,nbRecords):
-        result = parseTopazHeaderRecord()
-        #print result[0], result[1]
-        bookHeaderRecords[result[0]] = result[1]
+        cur = Cursor(data, 4)
+        nbRecords = readEncodedNumber(cur)
+        self.records = {}
+        
+        for i in range (0,nbRecords):
+            if ord(data[cur.pos]) != 0x63:
+                raise CMBDTCFatal("Parse Error : Invalid Header")
+            cur.pos += 1
+            tag = readString(cur)
+            nbValues = readEncodedNumber(cur)
+            values = []
+            for j in range (0,nbValues):
+                offset = readEncodedNumber(cur)
+                decompressedLength = readEncodedNumber(cur)
+                compressedLength = readEncodedNumber(cur)
+                values.append([offset,decompressedLength,compressedLength])
+            self.records[tag] = values
+        
+        if ord(data[cur.pos]) != 0x64 :
+            raise CMBDTCFatal("Parse Error : Invalid Header")
+        
+        self.payload_offset = cur.pos + 1
     
-    if ord(bookFile.read(1))  != 0x64 :
-        raise CMBDTCFatal("Parse Error : Invalid Header")
+    #
+    # Parse the metadata record from the book payload into a dict
+    #
     
-    bookPayloadOffset = bookFile.tell()
-   
-#
-# Get a record in the book payload, given its name and index. If necessary the record is decrypted. The record is not decompressed
-# Correction, the record is correctly decompressed too
-#
-
-def getBookPayloadRecord(name, index):   
-    encrypted = False
-    compressed = False
-
-    try: 
-        recordOffset = bookHeaderRecords[name][index][0]
-    except:
-        raise CMBDTCFatal("Parse Error : Invalid Record, record not found")
+    def parse_metadata(self):
+        data = self.data
+        self.metadata = {}
+        try:
+            pos = self.payload_offset + self.records["metadata"][0][0]
+        except (KeyError, IndexError):
+            raise CMBDTCFatal("Parse Error : Invalid Record, record not found")
+        cur = Cursor(data, pos)
+        tag = readString(cur)
+        if tag != "metadata" :
+            raise CMBDTCFatal("Parse Error : Record Names Don't Match")
+        
+        flags = ord(data[cur.pos])
+        nbRecords = ord(data[cur.pos+1])
+        cur.pos += 2
+        
+        for i in range (0,nbRecords) :
+            key = readString(cur)
+            value = readString(cur)
+            self.metadata[key] = value
     
-    bookFile.seek(bookPayloadOffset + recordOffset)
+    #
+    # Get a record in the book payload, given its name and index. If
+    # necessary the record is decrypted with the book key and decompressed.
+    #
     
-    tag = bookReadString()
-    if tag != name :
-        raise CMBDTCFatal("Parse Error : Invalid Record, record name doesn't match")
+    def get_record(self, name, index):
+        pos, length, encrypted, compressed = self.locate_record(name, index)
+        record = self.data[pos:pos+length]
+        
+        if encrypted:
+            record = topazCryptoDecryptInto(record, topazCryptoInit(self.key))
+            if compressed:
+                record = zlib.decompress(buffer(record))
+            else:
+                record = str(record)
+        elif compressed:
+            record = zlib.decompress(record)
+        
+        return record
     
-    recordIndex = bookReadEncodedNumber()
+    #
+    # Write a record to the file out like get_record() would return it, in
+    # blocks of chunk bytes, so that only about a block of the record is in
+    # memory at any time
+    #
     
-    if recordIndex < 0 :
-        encrypted = True
-        recordIndex = -recordIndex -1
+    def write_record(self, name, index, out, chunk=STREAM_CHUNK):
+        pos, length, encrypted, compressed = self.locate_record(name, index)
+        if encrypted:
+            ctx = topazCryptoInit(self.key)
+        if compressed:
+            inflater = zlib.decompressobj()
+        
+        end = pos + length
+        while pos < end:
+            block = self.data[pos:min(pos+chunk, end)]
+            pos += chunk
+            if encrypted:
+                block = buffer(topazCryptoDecryptInto(block, ctx))
+            if compressed:
+                block = inflater.decompress(block, chunk)
+                while block:
+                    out.write(block)
+                    block = inflater.decompress(inflater.unconsumed_tail, chunk)
+            else:
+                out.write(block)
+        
+        if compressed:
+            out.write(inflater.flush())
     
-    if recordIndex != index :
-      raise CMBDTCFatal("Parse Error : Invalid Record, index doesn't match")
-            
-    if (bookHeaderRecords[name][index][2] > 0):
-        compressed = True
-        record = bookFile.read(bookHeaderRecords[name][index][2])
-    else:
-        record = bookFile.read(bookHeaderRecords[name][index][1])
- 
-    if encrypted:
-       ctx = topazCryptoInit(bookKey)
-       record = topazCryptoDecrypt(record,ctx)
-
-    if compressed:
-        record = zlib.decompress(record)
+    #
+    # Check the name and index in front of a record and return the position
+    # and length of its data and whether it is encrypted and compressed
+    #
+    
+    def locate_record(self, name, index):
+        encrypted = False
+        
+        try:
+            recordOffset, decompressedLength, compressedLength = self.records[name][index]
+        except (KeyError, IndexError):
+            raise CMBDTCFatal("Parse Error : Invalid Record, record not found")
+        
+        data = self.data
+        try:
+            cur = Cursor(data, self.payload_offset + recordOffset)
+            tag = readString(cur)
+            recordIndex = readEncodedNumber(cur)
+            pos = cur.pos
+        except IndexError:
+            raise CMBDTCFatal("Parse Error : Invalid Record, record past the end of the book")
+        if tag != name :
+            raise CMBDTCFatal("Parse Error : Invalid Record, record name doesn't match")
+        
+        if recordIndex < 0 :
+            encrypted = True
+            recordIndex = -recordIndex -1
+        
+        if recordIndex != index :
+          raise CMBDTCFatal("Parse Error : Invalid Record, index doesn't match")
+        
+        if encrypted and self.key is None:
+            raise CMBDTCFatal("Record is encrypted and the book key is not known")
+        
+        return [pos, compressedLength or decompressedLength, encrypted, compressedLength > 0]
+    
+    #
+    # Generate (name, index, record) for all the records with the given names,
+    # in the order of names and then index, or in the order they are stored
+    # in the book if by_offset is set. The latter reads the book in a single
+    # forward sweep with READ_AHEAD bytes of read-ahead. The records are
+    # decrypted and decompressed on threads threads (zlib runs without the
+    # GIL) or on processes processes if more than one is asked for, with at
+    # most window records in flight at once so memory use stays bounded.
+    # Records that are at least threshold bytes once decompressed, if it
+    # isn't 0, are not read but generated as None, for the caller to stream
+    # them with write_record().
+    #
     
-    return record
+    def iter_records(self, names, threads=0, processes=0, window=0, threshold=0, by_offset=False):
+        jobs = []
+        for name in names:
+            for index in range (0,len(self.records.get(name, []))):
+                recordOffset, decompressedLength, compressedLength = self.records[name][index]
+                large = threshold > 0 and decompressedLength >= threshold
+                jobs.append([self.payload_offset + recordOffset, name, index, large])
+        
+        readAhead = None
+        if by_offset:
+            jobs.sort()
+            readAhead = ReadAhead(self.path)
+        
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, openWorkerBook, (self.path, self.key))
+            workers = processes
+            getRecord = getWorkerRecord
+        elif threads > 1:
+            pool = ThreadPool(threads)
+            workers = threads
+            getRecord = self.get_record
+        else:
+            pool = None
+            workers = 1
+        
+        window = window or 4 * workers
+        pending = collections.deque()
+        try:
+            for i in range (0,len(jobs)):
+                offset, name, index, large = jobs[i]
+                if readAhead != None:
+                    if i + 1 < len(jobs):
+                        readAhead.advance(offset, jobs[i+1][0])
+                    else:
+                        readAhead.advance(offset, len(self.data))
+                if pool == None:
+                    if large:
+                        yield name, index, None
+                    else:
+                        yield name, index, self.get_record(name, index)
+                    continue
+                if len(pending) >= window:
+                    name2, index2, result = pending.popleft()
+                    yield name2, index2, result and result.get()
+                if large:
+                    pending.append([name, index, None])
+                else:
+                    pending.append([name, index, pool.apply_async(getRecord, (name, index))])
+            while pending:
+                name, index, result = pending.popleft()
+                yield name, index, result and result.get()
+        finally:
+            if pool != None:
+                pool.terminate()
+                pool.join()
+            if readAhead != None:
+                readAhead.close()
+    
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+#
+# Reads a book file ahead of where its records are read from the memory map
+# in blocks of size bytes, so that the operating system fetches the book in
+# one sequential stream of large reads rather than a page fault at a time.
+# It has its own file handle, so it doesn't disturb other readers.
+#
+
+class ReadAhead(object):
+    def __init__(self, path, size=READ_AHEAD):
+        self.file = openBook(path)
+        self.size = size
+        self.pos = 0
+    
+    #
+    # A record is about to be read from start to end, read at least a block
+    # beyond it
+    #
+    
+    def advance(self, start, end):
+        if start > self.pos:
+            self.pos = start
+        while self.pos < end + self.size:
+            self.file.seek(self.pos)
+            block = len(self.file.read(self.size))
+            if block == 0:
+                break
+            self.pos += block
+    
+    def close(self):
+        self.file.close()
 
 #
-# Extract, decrypt and decompress a book record indicated by name and index and print it or save it in "filename"
+# The book of a worker process of TopazBook.iter_records()
 #
 
-def extractBookPayloadRecord(name, index, filename):
-    compressed = False
+workerBook = None
+
+def openWorkerBook(path, key):
+    global workerBook
+    workerBook = TopazBook(path)
+    workerBook.key = key
+
+def getWorkerRecord(name, index):
+    return workerBook.get_record(name, index)
+
+#
+# Extract, decrypt and decompress a book record indicated by name and index and print it or save it in "filename"
+#
 
+def extractBookPayloadRecord(book, name, index, filename):
     try:
-        compressed = bookHeaderRecords[name][index][2] != 0
-        record = getBookPayloadRecord(name,index)
-    except:
+        record = book.get_record(name,index)
+    except CMBDTCFatal:
         print("Could not find record")
-    
-    # if compressed:
-    #    try:
-    #        record = zlib.decompress(record)
-    #    except:
-    #        raise CMBDTCFatal("Could not decompress record")
+        return
             
     if filename != "":
         try:
@@ -244,33 +439,6 @@ def extractBookPayloadRecord(name, index, filename):
     else:
         print(record)
     
-#
-# return next record [key,value] from the book metadata from the current book position
-#  
-
-def readMetadataRecord():
-    return [bookReadString(),bookReadString()]
-    
-#
-# Parse the metadata record from the book payload and return a list of [key,values]
-#
-
-def parseMetadata():
-    global bookHeaderRecords
-    global bookPayloadAddress
-    global bookMetadata
-    bookMetadata = {}
-    bookFile.seek(bookPayloadOffset + bookHeaderRecords["metadata"][0][0])
-    tag = bookReadString()
-    if tag != "metadata" :
-        raise CMBDTCFatal("Parse Error : Record Names Don't Match")
-    
-    flags = ord(bookFile.read(1))
-    nbRecords = ord(bookFile.read(1))
-    
-    for i in range (0,nbRecords) :
-        record =readMetadataRecord()
-        bookMetadata[record[0]] = record[1]
 
 #
 # Context initialisation for the Topaz Crypto
@@ -304,13 +472,44 @@ def topazCryptoDecrypt(data, ctx):
         
     return plainText
 
+#
+# m * m * 0x0F902007 for every byte m, the key schedule of the Topaz Crypto
+#
+
+topazCryptoSquares = [(m * m * 0x0F902007) & 0xFFFFFFFF for m in range(256)]
+
+#
+# Same as topazCryptoDecrypt() but decrypt into the bytearray out (a new
+# one of the size of data if not given) and return it. ctx is updated so
+# that data following this data can be decrypted with it.
+#
+
+def topazCryptoDecryptInto(data, ctx, out=None):
+    ctx1 = ctx[0]
+    ctx2 = ctx[1]
+    squares = topazCryptoSquares
+
+    data = bytearray(data)
+    if out is None:
+        out = data
+    
+    for i in xrange(len(data)):
+        m = data[i] ^ ((ctx1 >> 3) & 0xFF) ^ ((ctx2 << 3) & 0xFF)
+        ctx2 = ctx1
+        ctx1 = (((ctx1 >> 2) * (ctx1 >> 7)) & 0xFFFFFFFF) ^ squares[m]
+        out[i] = m
+        
+    ctx[0] = ctx1
+    ctx[1] = ctx2
+    return out
+
 #
 # Decrypt a payload record with the PID
 #
 
 def decryptRecord(data,PID):
     ctx = topazCryptoInit(PID)
-    return topazCryptoDecrypt(data, ctx)
+    return str(topazCryptoDecryptInto(data, ctx))
 
 #
 # Try to decrypt a dkey record (contains the book PID)
@@ -349,30 +548,33 @@ def decryptDkeyRecords(data,PID):
     return records
 
 
-def createDecryptedPayload(payload):
-    for headerRecord in bookHeaderRecords:
-       name = headerRecord
-       if name != "dkey" :
-           ext = '.dat'
-           if name == 'img' : ext = '.jpg'
-           for index in range (0,len(bookHeaderRecords[name])) :
-               fnum = "%04d" % index
-               fname = name + fnum + ext
-               destdir = payload
-               if name == 'img':
-                   destdir =  os.path.join(payload,'img')
-               if name == 'page':
-                   destdir =  os.path.join(payload,'page')
-               if name == 'glyphs':
-                   destdir =  os.path.join(payload,'glyphs')
-               outputFile = os.path.join(destdir,fname)
-               file(outputFile, 'wb').write(getBookPayloadRecord(name, index))
+def createDecryptedPayload(book, payload, threads=0, processes=0):
+    names = [name for name in book.records if name != "dkey"]
+    for name, index, record in book.iter_records(names, threads, processes, threshold=STREAM_THRESHOLD, by_offset=True):
+        ext = '.dat'
+        if name == 'img' : ext = '.jpg'
+        fnum = "%04d" % index
+        fname = name + fnum + ext
+        destdir = payload
+        if name == 'img':
+            destdir =  os.path.join(payload,'img')
+        if name == 'page':
+            destdir =  os.path.join(payload,'page')
+        if name == 'glyphs':
+            destdir =  os.path.join(payload,'glyphs')
+        outputFile = os.path.join(destdir,fname)
+        out = file(outputFile, 'wb')
+        if record is None:
+            book.write_record(name, index, out)
+        else:
+            out.write(record)
+        out.close()
                    
 
 # Create decrypted book
 #
 
-def createDecryptedBook(outdir):
+def createDecryptedBook(book, outdir, threads=0, processes=0):
     if not os.path.exists(outdir):
         os.makedirs(outdir)
 
@@ -388,7 +590,7 @@ def createDecryptedBook(outdir):
     if not os.path.exists(destdir):
         os.makedirs(destdir)
 
-    createDecryptedPayload(outdir)
+    createDecryptedPayload(book, outdir, threads, processes)
 
 
 #
@@ -413,16 +615,15 @@ def usage():
     print("-d Dumps the unencrypted book as files to outdir")
     print("-o Output directory to save book files to")
     print("-v Verbose (can be used several times)")
+    print("-t Decompress the records on this many threads")
+    print("-j Decrypt the records on this many processes")
 
  
 #
 # Main
 #   
 
-def main(argv=sys.argv):
-    global bookMetadata
-    global bookKey
-    global bookFile
+def main(argv=sys.argv, key_cache=None):
     global command
     
     print argv
@@ -430,8 +631,8 @@ def main(argv=sys.argv):
     progname = os.path.basename(argv[0])
     
     verbose = 0
-    recordName = ""
-    recordIndex = 0
+    threads = 0
+    processes = 0
     outdir = ""
     PIDs = []
     command = ""
@@ -440,7 +641,7 @@ def main(argv=sys.argv):
     PIDs.append(kindlePID)
     
     try:
-        opts, args = getopt.getopt(argv[1:], "vo:p:d")
+        opts, args = getopt.getopt(argv[1:], "vo:p:dt:j:")
     except getopt.GetoptError, err:
         # print help information and exit:
         print str(err) # will print something like "option -a not recognized"
@@ -462,6 +663,10 @@ def main(argv=sys.argv):
             PIDs.append(a)
         if o =="-d":
             setCommand("doit")
+        if o =="-t":
+            threads = int(a)
+        if o =="-j":
+            processes = int(a)
             
     if command == "" :
         raise CMBDTCFatal("No action supplied on command line")
@@ -472,42 +677,72 @@ def main(argv=sys.argv):
         
     if len(args) == 1:
     
-        bookFile = openBook(args[0])
-        parseTopazHeader()
-        parseMetadata()
+        book = TopazBook(args[0])
+        try:
+            return processBook(book, PIDs, outdir, key_cache, verbose, threads, processes)
+        finally:
+            book.close()
+    
+    return 0
+
+#
+# Find the key of the book with one of the PIDs or in the key cache, returns None if it can't be found
+#
+
+def findBookKey(book, PIDs, key_cache=None):
+    dkey = book.get_record('dkey', 0) 
+    
+    if key_cache != None :
+        cachedKey = key_cache.get('topaz', dkey)
+        if cachedKey != None :
+            return cachedKey
+
+    bookKeys = []
+    for PID in PIDs :
+        bookKeys+=decryptDkeyRecords(dkey,PID)
+    if len(bookKeys) == 0 :
+        return None
+    if key_cache != None :
+        key_cache.put('topaz', dkey, bookKeys[0])
+    return bookKeys[0]
+
+#
+# Find the key of the book and execute the command on it
+#
+
+def processBook(book, PIDs, outdir, key_cache, verbose, threads=0, processes=0):
+    recordName = ""
+    recordIndex = 0
+    outputFile = ""
     
     #
     #  Decrypt book key
     #
     
-        dkey = getBookPayloadRecord('dkey', 0) 
+    bookKey = findBookKey(book, PIDs, key_cache)
         
-        bookKeys = []
-        for PID in PIDs :
-            bookKeys+=decryptDkeyRecords(dkey,PID)
-            
-        if len(bookKeys) == 0 :
-            if verbose > 0 :
-                print ("Book key could not be found. Maybe this book is not registered with this device.")
+    if bookKey == None :
+        if verbose > 0 :
+            print ("Book key could not be found. Maybe this book is not registered with this device.")
+            return 1
+    else :
+        book.key = bookKey
+        if verbose > 0:
+            print("Book key: " + book.key.encode('hex'))
+              
+        if command == "printRecord" :
+            extractBookPayloadRecord(book,recordName,int(recordIndex),outputFile)
+            if outputFile != "" and verbose>0 :
+                print("Wrote record to file: "+outputFile) 
+        elif command == "doit" :
+            if outdir != "" :
+                createDecryptedBook(book, outdir, threads, processes)
+                if verbose >0 :
+                    print ("Decrypted book saved. Don't pirate!")
+            elif verbose > 0:
+                print("Output directory name was not supplied.")
                 return 1
-        else :
-            bookKey = bookKeys[0]
-            if verbose > 0:
-                print("Book key: " + bookKey.encode('hex'))
-                  
-            if command == "printRecord" :
-                extractBookPayloadRecord(recordName,int(recordIndex),outputFile)
-                if outputFile != "" and verbose>0 :
-                    print("Wrote record to file: "+outputFile) 
-            elif command == "doit" :
-                if outdir != "" :
-                    createDecryptedBook(outdir)
-                    if verbose >0 :
-                        print ("Decrypted book saved. Don't pirate!")
-                elif verbose > 0:
-                    print("Output directory name was not supplied.")
-                    return 1
-    
+
     return 0
 
 if __name__ == '__main__':
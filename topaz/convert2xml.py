@@ -14,44 +14,16 @@ class Unbuffered:
 import sys
 sys.stdout=Unbuffered(sys.stdout)
 
+import collections
 import csv
 import os
 import getopt
+import threading
 from struct import pack
-from struct import unpack
 
+# local routines
+from cursor import Cursor
 
-# Get a 7 bit encoded number from string. The most 
-# significant byte comes first and has the high bit (8th) set
-
-def readEncodedNumber(file):
-    flag = False
-    c = file.read(1)
-    if (len(c) == 0):
-        return None
-    data = ord(c)
-    
-    if data == 0xFF:
-       flag = True
-       c = file.read(1)
-       if (len(c) == 0):
-           return None
-       data = ord(c)
-       
-    if data >= 0x80:
-        datax = (data & 0x7F)
-        while data >= 0x80 :
-            c = file.read(1)
-            if (len(c) == 0): 
-                return None
-            data = ord(c)
-            datax = (datax <<7) + (data & 0x7F)
-        data = datax 
-    
-    if flag:
-       data = -data
-    return data
-    
 
 # returns a binary string that encodes a number into 7 bits
 # most significant byte first which has the high bit set
@@ -88,15 +60,6 @@ def encodeNumber(number):
 def lengthPrefixString(data):
     return encodeNumber(len(data))+data
 
-def readString(file):
-    stringLength = readEncodedNumber(file)
-    if (stringLength == None):
-        return ""
-    sv = file.read(stringLength)
-    if (len(sv)  != stringLength):
-        return ""
-    return unpack(str(stringLength)+"s",sv)[0]  
-
  
 # convert a binary string generated by encodeNumber (7 bit encoded number)
 # to the value you would find inside the page*.dat files to be processed
@@ -113,16 +76,19 @@ def convert(i):
 
 # the complete string table used to store all book text content
 # as well as the xml tokens and values that make sense out of it
+# it is read from dictFile or, if given, from the dict record data
 
 class Dictionary(object):
-    def __init__(self, dictFile):
+    def __init__(self, dictFile, data=None):
         self.filename = dictFile
         self.size = 0
-        self.fo = file(dictFile,'rb')
+        if data is None:
+            data = file(dictFile,'rb').read()
+        cur = Cursor(data)
         self.stable = []
-        self.size = readEncodedNumber(self.fo)
+        self.size = cur.read_number()
         for i in xrange(self.size):
-            self.stable.append(self.escapestr(readString(self.fo)))
+            self.stable.append(self.escapestr(cur.read_string() or ""))
         self.pos = 0
 
     def escapestr(self, str):
@@ -151,18 +117,70 @@ class Dictionary(object):
             print "%d %s %s" % (i, convert(i), self.stable[i])
         return
 
+
+# the dictionaries of the last few books, keyed by the path of the
+# dict0000.dat file and checked against its modification time and size
+
+DICTIONARY_CACHE_SIZE = 4
+dictionaryCache = collections.OrderedDict()
+
+# return the Dictionary of dictFile, reading it only if it isn't cached or
+# the file changed since it was cached
+
+def getDictionary(dictFile):
+    path = os.path.abspath(dictFile)
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+    entry = dictionaryCache.pop(path, None)
+    if (entry == None) or (entry[0] != stamp):
+        entry = (stamp, Dictionary(dictFile))
+    dictionaryCache[path] = entry
+    while len(dictionaryCache) > DICTIONARY_CACHE_SIZE:
+        dictionaryCache.popitem(last=False)
+    return entry[1]
+
+# compile a table of dotted tag paths into a trie of the tokens of the paths
+# read backwards from their last token. A node is [entry, {token: node}],
+# where entry is the table entry of the path ending at the node or None
+
+def compileTagPaths(table):
+    trie = [None, {}]
+    for path, entry in table.items():
+        node = trie
+        for token in reversed(path.split('.')):
+            node = node[1].setdefault(token, [None, {}])
+        node[0] = entry
+    return trie
+
+# return the entry of the longest suffix of the tag path (a tuple of
+# tokens) in the trie compiled by compileTagPaths(), or None
+
+def resolveTagPath(trie, path):
+    entry = None
+    node = trie
+    for token in reversed(path):
+        node = node[1].get(token)
+        if node == None:
+            break
+        if node[0] != None:
+            entry = node[0]
+    return entry
+
 # parses the xml snippets that are represented by each page*.dat file.
 # also parses the other0.dat file - the main stylesheet
 # and information used to inject the xml snippets into page*.dat files
+# the record is read from filename or, if given, from its data
 
 class PageParser(object):
-    def __init__(self, filename, dict, debug, flat_xml):
-        self.fo = file(filename,'rb')
+    def __init__(self, filename, dict, debug, flat_xml, data=None):
+        if data is None:
+            data = file(filename,'rb').read()
+        self.cur = Cursor(data)
         self.id = os.path.basename(filename).replace('.dat','')
         self.dict = dict
         self.debug = debug
         self.flat_xml = flat_xml
-        self.tagpath = []
+        self.tagpath = [0]
         self.doc = []
         self.snippetList = []
 
@@ -346,21 +364,44 @@ class PageParser(object):
 
      }
 
+    token_trie = compileTagPaths(token_tags)
+
+    # The tag paths are resolved by a state machine that is shared by all
+    # the parsers and grows as new paths are seen. self.tagpath is the stack
+    # of the states of the current path, state 0 is the empty path.
+    # tag_states maps (state, token) to the state of the path with token
+    # pushed on it, tag_info has for each state [the path as a tuple of
+    # tokens, the dotted path, the token_tags entry of its longest suffix].
+    # New states are added under tag_lock so that parsers on several
+    # threads can't give two paths the same state, a state is only put in
+    # tag_states once its tag_info is complete
+    tag_states = {}
+    tag_info = [[(), '', None]]
+    tag_lock = threading.Lock()
+
+    def add_tag_state(self, state, token):
+        with self.tag_lock:
+            newstate = self.tag_states.get((state, token))
+            if newstate == None:
+                path = self.tag_info[state][0] + (token,)
+                newstate = len(self.tag_info)
+                self.tag_info.append([path, '.'.join(path), resolveTagPath(self.token_trie, path)])
+                self.tag_states[(state, token)] = newstate
+        return newstate
 
     # full tag path record keeping routines
     def tag_push(self, token):
-        self.tagpath.append(token)
+        state = self.tag_states.get((self.tagpath[-1], token))
+        if state == None:
+            state = self.add_tag_state(self.tagpath[-1], token)
+        self.tagpath.append(state)
     def tag_pop(self):
-        if len(self.tagpath) > 0 :
+        if len(self.tagpath) > 1 :
             self.tagpath.pop()
     def tagpath_len(self):
-        return len(self.tagpath)
+        return len(self.tagpath) - 1
     def get_tagpath(self, i):
-        cnt = len(self.tagpath)
-        if i < cnt : result = self.tagpath[i]
-        for j in xrange(i+1, cnt) :
-            result += '.' + self.tagpath[j]
-        return result
+        return '.'.join(self.tag_info[self.tagpath[-1]][0][i:])
             
 
     # list of absolute command byte values values that indicate
@@ -370,21 +411,12 @@ class PageParser(object):
 
     # peek at and return 1 byte that is ahead by i bytes 
     def peek(self, aheadi):
-        c = self.fo.read(aheadi)
-        if (len(c) == 0):
-            return None
-        self.fo.seek(-aheadi,1)
-        c = c[-1:]
-        return ord(c)
+        return self.cur.peek_byte(aheadi - 1)
 
 
     # get the next value from the file being processed
     def getNext(self):
-        nbyte = self.peek(1);
-        if (nbyte == None):
-            return None
-        val = readEncodedNumber(self.fo)
-        return val
+        return self.cur.read_number()
 
 
     # format an arg by argtype
@@ -405,38 +437,30 @@ class PageParser(object):
     # arguments, and commands
     def procToken(self, token):
 
-        known_token = False
         self.tag_push(token)
+        path, tkn, entry = self.tag_info[self.tagpath[-1]]
 
-        if self.debug : print 'Processing: ', self.get_tagpath(0)
-        cnt = self.tagpath_len()
-        for j in xrange(cnt):
-            tkn = self.get_tagpath(j)
-            if tkn in self.token_tags :
-                num_args = self.token_tags[tkn][0]
-                argtype = self.token_tags[tkn][1]
-                subtags = self.token_tags[tkn][2]
-                splcase = self.token_tags[tkn][3]
-                ntags = -1
-                known_token = True
-                break
+        if self.debug : print 'Processing: ', tkn
 
-        if known_token :
+        # the entry of the longest suffix of the path in token_tags
+        if entry != None :
+            num_args, argtype, subtags, splcase = entry
+            ntags = -1
 
             # handle subtags if present 
             subtagres = []
             if (splcase == 1):
                 # this type of tag uses of escape marker 0x74 indicate subtag count
                 if self.peek(1) == 0x74:
-                    skip = readEncodedNumber(self.fo)
+                    skip = self.cur.read_number()
                     subtags = 1
                     num_args = 0
 
             if (subtags == 1): 
-                ntags = readEncodedNumber(self.fo)
+                ntags = self.cur.read_number()
                 if self.debug : print 'subtags: ' + token + ' has ' + str(ntags)
                 for j in xrange(ntags):
-                    val = readEncodedNumber(self.fo)
+                    val = self.cur.read_number()
                     subtagres.append(self.procToken(self.dict.lookup(val)))
 
             # arguments can be scalars or vectors of text or numbers
@@ -445,16 +469,15 @@ class PageParser(object):
                 firstarg = self.peek(1)
                 if (firstarg in self.cmd_list) and (argtype != 'scalar_number') and (argtype != 'scalar_text'):
                     # single argument is a variable length vector of data
-                    arg = readEncodedNumber(self.fo)
+                    arg = self.cur.read_number()
                     argres = self.decodeCMD(arg,argtype)
                 else :
                     # num_arg scalar arguments
                     for i in xrange(num_args):
-                        argres.append(self.formatArg(readEncodedNumber(self.fo), argtype))
+                        argres.append(self.formatArg(self.cur.read_number(), argtype))
 
             # build the return tag
             result = []
-            tkn = self.get_tagpath(0)
             result.append(tkn)
             result.append(subtagres)
             result.append(argtype)
@@ -477,7 +500,7 @@ class PageParser(object):
     # it is NEVER used to format arguments.
     # builds the snippetList
     def doLoop72(self, argtype):
-        cnt = readEncodedNumber(self.fo)
+        cnt = self.cur.read_number()
         if self.debug :
             result = 'Set of '+ str(cnt) + ' xml snippets. The overall structure \n'
             result += 'of the document is indicated by snippet number sets at the\n'
@@ -487,7 +510,7 @@ class PageParser(object):
             if self.debug: print 'Snippet:',str(i)
             snippet = []
             snippet.append(i)
-            val = readEncodedNumber(self.fo)
+            val = self.cur.read_number()
             snippet.append(self.procToken(self.dict.lookup(val)))
             self.snippetList.append(snippet)
         return
@@ -495,21 +518,24 @@ class PageParser(object):
 
 
     # general loop code gracisouly submitted by "skindle" - thank you!
+    # the cnt values are read in one pass, then adj is taken off each and
+    # the vector is replaced by its running sums mode times (delta coding)
     def doLoop76Mode(self, argtype, cnt, mode):
-        result = []
         adj = 0
         if mode & 1:
-            adj = readEncodedNumber(self.fo)
+            adj = self.cur.read_number()
         mode = mode >> 1
-        x = []
-        for i in xrange(cnt):
-            x.append(readEncodedNumber(self.fo) - adj)
+        x = self.cur.read_numbers(cnt)
+        if adj:
+            x = [v - adj for v in x]
         for i in xrange(mode):
-            for j in xrange(1, cnt):
-                x[j] = x[j] + x[j - 1]
-        for i in xrange(cnt):
-            result.append(self.formatArg(x[i],argtype))
-        return result
+            total = 0
+            for j in xrange(cnt):
+                total += x[j]
+                x[j] = total
+        if (argtype == 'raw') or (argtype == 'number') or (argtype == 'snippets') :
+            return x
+        return [self.formatArg(v, argtype) for v in x]
 
 
     # dispatches loop commands bytes with various modes
@@ -523,8 +549,8 @@ class PageParser(object):
         if (cmd == 0x76):
 
             # loop with cnt, and mode to control loop styles
-            cnt = readEncodedNumber(self.fo)
-            mode = readEncodedNumber(self.fo)
+            cnt = self.cur.read_number()
+            mode = self.cur.read_number()
 
             if self.debug : print 'Loop for', cnt, 'with  mode', mode,  ':  '
             return self.doLoop76Mode(argtype, cnt, mode)
@@ -669,21 +695,21 @@ class PageParser(object):
     def process(self):
 
         # peek at the first bytes to see what type of file it is
-        magic = self.fo.read(9)
+        magic = self.cur.read(9)
         if (magic[0:1] == 'p') and (magic[2:9] == 'marker_'):
             first_token = 'info'
         elif (magic[0:1] == 'p') and (magic[2:9] == '__PAGE_'):
-            skip = self.fo.read(2)
+            skip = self.cur.read(2)
             first_token = 'info'
         elif (magic[0:1] == 'p') and (magic[2:8] == '_PAGE_'):
             first_token = 'info'
         elif (magic[0:1] == 'g') and (magic[2:9] == '__GLYPH'):
-            skip = self.fo.read(3)
+            skip = self.cur.read(3)
             first_token = 'info'
         else :
             # other0.dat file
             first_token = None
-            self.fo.seek(-9,1)
+            self.cur.pos = 0
 
 
         # main loop to read and build the document tree
@@ -711,7 +737,7 @@ class PageParser(object):
                     print "Main Loop:  Unknown value: %x" % v 
                 if (v == 0):
                     if (self.peek(1) == 0x5f):
-                        skip = self.fo.read(1)
+                        skip = self.cur.read(1)
                         first_token = 'info'
 
         # now do snippet injection
@@ -730,6 +756,21 @@ class PageParser(object):
         return xmlpage
 
 
+
+# convert the data of a page, glyphs or other record named filename
+# (e.g. page0001.dat) to xml, without going through a file
+
+def convertData(dict, filename, data, flat_xml=True, debug=False):
+    pp = PageParser(filename, dict, debug, flat_xml, data)
+    return pp.process()
+
+# convert the page, glyphs or other file filename to xml with the
+# already loaded Dictionary dict
+
+def convertFile(dict, filename, flat_xml=True, debug=False):
+    pp = PageParser(filename, dict, debug, flat_xml)
+    return pp.process()
+
     
 def usage():
     print 'Usage: '
@@ -786,7 +827,7 @@ def main(argv):
     dictFile, pageFile = args[0], args[1]
 
     # read in the string table dictionary
-    dict = Dictionary(dictFile)
+    dict = getDictionary(dictFile)
     # dict.dumpDict()
 
     # create a page parser
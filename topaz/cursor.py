@@ -0,0 +1,107 @@
+#! /usr/bin/python
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+# For use with Topaz Scripts Version 2.6
+
+# A position in a Topaz file or record held in memory (a string, a buffer
+# or a memory map), from which the 7 bit encoded numbers and length
+# prefixed strings the format is made of are read. This replaces reading
+# them a byte at a time from a file.
+#
+# The readers return None if the data ends before the value does, like
+# reading past the end of a file did.
+
+# Decode the 7 bit encoded number at pos of data, which ends at end. The
+# most significant byte comes first and has the high bit (8th) set, a
+# leading 0xFF makes it negative. Returns [number, position after it], the
+# number is None if the data ends before it does.
+
+def decodeNumber(data, pos, end):
+    if pos >= end:
+        return [None, pos]
+    value = ord(data[pos])
+    pos += 1
+
+    negative = False
+    if value == 0xFF:
+        if pos >= end:
+            return [None, pos]
+        negative = True
+        value = ord(data[pos])
+        pos += 1
+
+    if value >= 0x80:
+        valuex = value & 0x7F
+        while value >= 0x80:
+            if pos >= end:
+                return [None, pos]
+            value = ord(data[pos])
+            pos += 1
+            valuex = (valuex << 7) + (value & 0x7F)
+        value = valuex
+
+    if negative:
+        value = -value
+    return [value, pos]
+
+
+class Cursor(object):
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+        self.end = len(data)
+
+    # return the byte i bytes ahead of the position (0 is the next one)
+    # without moving, or None if it is past the end
+    def peek_byte(self, i=0):
+        pos = self.pos + i
+        if pos >= self.end:
+            return None
+        return ord(self.data[pos])
+
+    # read a 7 bit encoded number (see decodeNumber)
+    def read_number(self):
+        value, self.pos = decodeNumber(self.data, self.pos, self.end)
+        return value
+
+    # read a vector of count 7 bit encoded numbers in one pass, returns a
+    # list of them or None if the data ends before the last one does
+    def read_numbers(self, count):
+        data = self.data
+        pos = self.pos
+        end = self.end
+        result = [0] * count
+        for i in xrange(count):
+            # most values fit in one byte, only the others need decoding
+            if pos < end:
+                value = ord(data[pos])
+                if value < 0x80:
+                    result[i] = value
+                    pos += 1
+                    continue
+            value, pos = decodeNumber(data, pos, end)
+            if value == None:
+                self.pos = pos
+                return None
+            result[i] = value
+
+        self.pos = pos
+        return result
+
+    # read a length prefixed string
+    def read_string(self):
+        length = self.read_number()
+        if (length == None) or (self.pos + length > self.end):
+            self.pos = self.end
+            return None
+        value = self.data[self.pos:self.pos + length]
+        self.pos += length
+        return value
+
+    # read up to n bytes
+    def read(self, n):
+        value = self.data[self.pos:self.pos + n]
+        self.pos += len(value)
+        return value
+
+    def at_end(self):
+        return self.pos >= self.end
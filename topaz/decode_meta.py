@@ -7,40 +7,10 @@ import sys
 import os
 import getopt
 from struct import pack
-from struct import unpack
 
-#
-# Get a 7 bit encoded number from string
-#
+# local routines
+from cursor import Cursor
 
-def readEncodedNumber(file):
-    flag = False
-    c = file.read(1)
-    if (len(c) == 0):
-        return None
-    data = ord(c)
-    
-    if data == 0xFF:
-       flag = True
-       c = file.read(1)
-       if (len(c) == 0):
-           return None
-       data = ord(c)
-       
-    if data >= 0x80:
-        datax = (data & 0x7F)
-        while data >= 0x80 :
-            c = file.read(1)
-            if (len(c) == 0): 
-                return None
-            data = ord(c)
-            datax = (datax <<7) + (data & 0x7F)
-        data = datax 
-    
-    if flag:
-       data = -data
-    return data
-    
 #
 # Encode a number in 7 bit format
 #
@@ -71,31 +41,30 @@ def encodeNumber(number):
    return result[::-1]
   
 #
-# Get a length prefixed string from the file 
+# Returns a length prefixed string
 #
 def lengthPrefixString(data):
     return encodeNumber(len(data))+data
 
-def readString(file):
-    stringLength = readEncodedNumber(file)
-    if (stringLength == None):
-        return None
-    sv = file.read(stringLength)
-    if (len(sv)  != stringLength):
+#
+# Get a length prefixed string from the cursor, "" if it is truncated
+#
+def readString(cur):
+    value = cur.read_string()
+    if value == None:
         return ""
-    return unpack(str(stringLength)+"s",sv)[0]  
+    return value
 
 
 
 def getMetaArray(metaFile):
     # parse the meta file into a Python dictionary (associative array)
     result = {}
-    fo = file(metaFile,'rb')
-    size = readEncodedNumber(fo)
+    cur = Cursor(file(metaFile,'rb').read())
+    size = cur.read_number()
     for i in xrange(size):
-        temp = readString(fo)
-        result[temp] = readString(fo)
-    fo.close()
+        temp = readString(cur)
+        result[temp] = readString(cur)
     return result
 
 
@@ -103,10 +72,9 @@ def getMetaArray(metaFile):
 def getMetaData(metaFile):
     # parse the meta file
     result = ''    
-    fo = file(metaFile,'rb')
-    size = readEncodedNumber(fo)
+    cur = Cursor(file(metaFile,'rb').read())
+    size = cur.read_number()
     for i in xrange(size):
-        result += readString(fo) + '|'
-        result += readString(fo) + '\n'
-    fo.close()
+        result += readString(cur) + '|'
+        result += readString(cur) + '\n'
     return result
@@ -12,7 +12,7 @@ from struct import unpack
 
 
 class DocParser(object):
-    def __init__(self, flatxml, classlst, fileid, bookDir, fixedimage):
+    def __init__(self, flatxml, classlst, fileid, bookDir, fixedimage, glyphs=None):
         self.id = os.path.basename(fileid).replace('.dat','')
         self.svgcount = 0
         self.docList = flatxml.split('\n')
@@ -21,6 +21,8 @@ class DocParser(object):
         self.bookDir = bookDir
         self.glyphPaths = { }
         self.numPaths = 0
+        # lines of svg/glyphs.svg, read from there when first needed if not given
+        self.glyphs = glyphs
         tmpList = classlst.split('\n')
         for pclass in tmpList:
             if pclass != '':
@@ -67,14 +69,14 @@ class DocParser(object):
 
         # build hashtable of glyph paths keyed by glyph id
         if self.numPaths == 0:
-            gfile = open(glyfile, 'r')
-            while True:
-                path = gfile.readline()
-                if (path == ''): break
+            if self.glyphs is None:
+                gfile = open(glyfile, 'r')
+                self.glyphs = gfile.readlines()
+                gfile.close()
+            for path in self.glyphs:
                 glyphid = extractID(path,'id="')
                 self.glyphPaths[glyphid] = path
                 self.numPaths += 1
-            gfile.close()
 
 
         # get glyph information
@@ -720,10 +722,10 @@ class DocParser(object):
 
 
 
-def convert2HTML(flatxml, classlst, fileid, bookDir, fixedimage):
+def convert2HTML(flatxml, classlst, fileid, bookDir, fixedimage, glyphs=None):
 
     # create a document parser
-    dp = DocParser(flatxml, classlst, fileid, bookDir, fixedimage)
+    dp = DocParser(flatxml, classlst, fileid, bookDir, fixedimage, glyphs)
 
     htmlpage = dp.process()
 
@@ -0,0 +1,204 @@
+#! /usr/bin/python
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+# For use with Topaz Scripts Version 2.6
+
+class Unbuffered:
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout=Unbuffered(sys.stdout)
+
+import os, getopt
+
+# local routines
+import cmbtc
+import convert2xml
+import decode_meta
+import flatxml2html
+import genhtml
+import gensvg
+
+
+def usage():
+    print 'Usage: '
+    print ' '
+    print '   genbook.py [options] bookFileName|unencryptedBookDir outputDir'
+    print '  '
+    print '  Options:  '
+    print '     -p PID          : adds a PID to the list of PIDs that are tried to decrypt the book key '
+    print '     -t N            : decompress the records on N threads '
+    print '     -j N            : decrypt the records on N processes '
+    print '     --svg           : also output browseable XHTML+SVG pages to outputDir/svg '
+    print '     --raw           : output raw SVG images instead of XHTML+SVG pages '
+    print '     --fixed-image   : force translation of fixed regions into svg images '
+    print '  '
+
+
+# the records of a book dumped to a directory by cmbtc -d, read like those
+# of a cmbtc.TopazBook
+class BookDirectory(object):
+    def __init__(self, bookDir):
+        self.bookDir = bookDir
+        self.records = {}
+        for name in ['dict', 'other', 'metadata']:
+            if os.path.exists(self.getPath(name, 0)):
+                self.records[name] = [None]
+        # only the files named like cmbtc names the records count, others
+        # (like the svg images genhtml adds to img) are ignored
+        for name in ['img', 'page', 'glyphs']:
+            count = 0
+            while os.path.exists(self.getPath(name, count)):
+                count += 1
+            if count > 0:
+                self.records[name] = [None] * count
+        self.metadata = decode_meta.getMetaArray(self.getPath('metadata', 0))
+
+    def getPath(self, name, index):
+        if name == 'img':
+            return os.path.join(self.bookDir, 'img', 'img%04d.jpg' % index)
+        if name in ['page', 'glyphs']:
+            return os.path.join(self.bookDir, name, '%s%04d.dat' % (name, index))
+        return os.path.join(self.bookDir, '%s%04d.dat' % (name, index))
+
+    def get_record(self, name, index):
+        return file(self.getPath(name, index), 'rb').read()
+
+    # the records are already decrypted, so the options are ignored
+    def iter_records(self, names, threads=0, processes=0, window=0, threshold=0, by_offset=False):
+        for name in names:
+            for index in xrange(len(self.records.get(name, []))):
+                yield name, index, self.get_record(name, index)
+
+    def close(self):
+        pass
+
+
+# convert the opened Topaz book, whose key must be set, in memory and write
+# book.html, style.css and img to outdir, and the svg pages to outdir/svg
+# if svg is set. Does the same as cmbtc -d followed by gensvg and genhtml,
+# without writing every record to a file and reading it back, and decodes
+# every page once for both the svg and the html. The records are extracted
+# on threads threads or processes processes (see
+# cmbtc.TopazBook.iter_records). book can also be a BookDirectory
+def convertBook(book, outdir, svg=False, raw=False, fixedimage=False, threads=0, processes=0):
+    metadata = book.metadata
+    dict = convert2xml.Dictionary('dict0000.dat', book.get_record('dict', 0))
+
+    imgDir = os.path.join(outdir,'img')
+    if not os.path.exists(imgDir) :
+        os.makedirs(imgDir)
+    svgDir = os.path.join(outdir,'svg')
+    if svg and not os.path.exists(svgDir) :
+        os.makedirs(svgDir)
+
+    print 'Processing Images ... '
+    for name, index, record in book.iter_records(['img'], threads, processes, threshold=cmbtc.STREAM_THRESHOLD, by_offset=True):
+        out = file(os.path.join(imgDir, 'img%04d.jpg' % index), 'wb')
+        if record is None:
+            book.write_record(name, index, out)
+        else:
+            out.write(record)
+        out.close()
+
+    print 'Processing Glyphs ... '
+    glyphs = []
+    for name, index, record in book.iter_records(['glyphs'], threads, processes):
+        flat_xml = convert2xml.convertData(dict, 'glyphs%04d.dat' % index, record)
+        glyphs.extend(gensvg.glyphDefs(flat_xml, index))
+    glyfstr = gensvg.glyphsSVG(glyphs, metadata)
+    if svg :
+        file(os.path.join(svgDir, 'glyphs.svg'), 'w').write(glyfstr)
+    # the lines of glyphs.svg, as the page converters would read them
+    glyphs = glyfstr.splitlines(True)
+
+    print 'Processing Style Sheet ... '
+    pnum = genhtml.firstTextPage(metadata) + 1
+    page_xml = convert2xml.convertData(dict, 'page%04d.dat' % pnum, book.get_record('page', pnum))
+    xmlstr = convert2xml.convertData(dict, 'other0000.dat', book.get_record('other', 0))
+    cssstr, classlst = genhtml.convertCSS(xmlstr, page_xml, metadata)
+    file(os.path.join(outdir, 'style.css'), 'wb').write(cssstr)
+
+    print 'Processing Pages ... '
+    npages = len(book.records['page'])
+    body = []
+    for name, index, record in book.iter_records(['page'], threads, processes):
+        fname = 'page%04d.dat' % index
+        flat_xml = convert2xml.convertData(dict, fname, record)
+        if svg :
+            if raw :
+                pname = fname.replace('.dat','.svg')
+            else :
+                pname = 'page%04d.xhtml' % index
+            file(os.path.join(svgDir, pname), 'w').write(gensvg.pageSVG(flat_xml, index, npages, glyphs, metadata, raw))
+        body.append(flatxml2html.convert2HTML(flat_xml, classlst, fname, outdir, fixedimage, glyphs))
+
+    file(os.path.join(outdir, 'book.html'), 'wb').write(genhtml.bookHTML(metadata, ''.join(body)))
+    print 'Processing Complete'
+
+
+def main(argv):
+    PIDs = [cmbtc.kindlePID]
+    svg = False
+    raw = False
+    fixedimage = False
+    threads = 0
+    processes = 0
+
+    if len(argv) == 0:
+        argv = sys.argv
+
+    try:
+        opts, args = getopt.getopt(argv[1:], "hp:t:j:", ["svg", "raw", "fixed-image"])
+
+    except getopt.GetoptError, err:
+        print str(err)
+        usage()
+        sys.exit(1)
+
+    if len(args) != 2 :
+        usage()
+        sys.exit(1)
+
+    for o, a in opts:
+        if o =="-h":
+            usage()
+            sys.exit(0)
+        if o =="-p":
+            PIDs.append(a)
+        if o =="-t":
+            threads = int(a)
+        if o =="-j":
+            processes = int(a)
+        if o =="--svg":
+            svg = True
+        if o =="--raw":
+            raw = True
+        if o =="--fixed-image":
+            fixedimage = True
+
+    if os.path.isdir(args[0]) :
+        book = BookDirectory(args[0])
+        convertBook(book, args[1], svg, raw, fixedimage)
+        return 0
+
+    book = cmbtc.TopazBook(args[0])
+    try:
+        book.key = cmbtc.findBookKey(book, PIDs)
+        if book.key == None :
+            print "Book key could not be found. Maybe this book is not registered with this device."
+            return 1
+        convertBook(book, args[1], svg, raw, fixedimage, threads, processes)
+    finally:
+        book.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(''))
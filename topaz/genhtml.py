@@ -99,17 +99,12 @@ def main(argv):
         sys.exit(1)
 
     htmlFileName = "book.html"
-    htmlstr = '<!DOCTYPE HTML PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n'
-    htmlstr += '<html>\n'
 
     filenames = os.listdir(pageDir)
     filenames = sorted(filenames)
 
     print 'Processing ... '
 
-    htmlstr += '<head>\n'
-    htmlstr += '<meta http-equiv="content-type" content="text/html; charset=utf-8"/>\n'
-
     # process metadata and retrieve fontSize info
     print '     ', 'metadata0000.dat'
     fname = os.path.join(bookDir,'metadata0000.dat')
@@ -118,66 +113,84 @@ def main(argv):
     file(xname, 'wb').write(metastr)
     meta_array = decode_meta.getMetaArray(fname)
 
-    htmlstr += '<title>' + meta_array['Title'] + ' by ' + meta_array['Authors'] + '</title>\n' 
-    htmlstr += '<meta name="Author" content="' + meta_array['Authors'] + '" />\n'
-    htmlstr += '<meta name="Title" content="' + meta_array['Title'] + '" />\n'
+    classlst = generateCSS(bookDir, dictFile, pageDir, meta_array)
+    htmlstr = bookHTML(meta_array, generateHTML(dictFile, pageDir, bookDir, filenames, classlst, fixedimage))
 
-    # get some scaling info from metadata to use while processing styles
-    fontsize = '135'
-    if 'fontSize' in meta_array:
-        fontsize = meta_array['fontSize']
+    file(os.path.join(bookDir, htmlFileName), 'wb').write(htmlstr)
+    print 'Processing Complete'
 
-    # also get the size of a normal text page
-    spage = '1'
-    if 'firstTextPage' in meta_array:
-        spage = meta_array['firstTextPage']
-    pnum = int(spage)
+    return 0
 
+
+# convert the stylesheet in other0000.dat to style.css, scaled to the size
+# of the first text page, and return the list of the css classes
+def generateCSS(bookDir, dictFile, pageDir, meta_array):
+    dict = convert2xml.getDictionary(dictFile)
     # get page height and width from first text page for use in stylesheet scaling
-    pname = 'page%04d.dat' % (pnum + 1)
+    pname = 'page%04d.dat' % (firstTextPage(meta_array) + 1)
     fname = os.path.join(pageDir,pname)
-    pargv=[]
-    pargv.append('convert2xml.py')
-    pargv.append('--flat-xml')
-    pargv.append(dictFile)
-    pargv.append(fname)
-    flat_xml = convert2xml.main(pargv)
-    (ph, pw) = getpagedim.getPageDim(flat_xml)
-    if (ph == '-1') or (ph == '0') : ph = '11000'
-    if (pw == '-1') or (pw == '0') : pw = '8500'
+    flat_xml = convert2xml.convertFile(dict, fname)
 
     # now build up the style sheet
     print '     ', 'other0000.dat'
     fname = os.path.join(bookDir,'other0000.dat')
     xname = os.path.join(bookDir, 'style.css')
-    pargv=[]
-    pargv.append('convert2xml.py')
-    pargv.append('--flat-xml')
-    pargv.append(dictFile)
-    pargv.append(fname)
-    xmlstr = convert2xml.main(pargv)
-    cssstr , classlst = stylexml2css.convert2CSS(xmlstr, fontsize, ph, pw)
+    xmlstr = convert2xml.convertFile(dict, fname)
+    cssstr , classlst = convertCSS(xmlstr, flat_xml, meta_array)
     file(xname, 'wb').write(cssstr)
+    return classlst
+
+
+# the number of the page before the first text page of the book
+def firstTextPage(meta_array):
+    spage = '1'
+    if 'firstTextPage' in meta_array:
+        spage = meta_array['firstTextPage']
+    return int(spage)
+
+
+# convert the xml of the stylesheet to css scaled to the size of the page
+# with the flat xml page_xml, returns the css and the list of the css classes
+def convertCSS(xmlstr, page_xml, meta_array):
+    # get some scaling info from metadata to use while processing styles
+    fontsize = '135'
+    if 'fontSize' in meta_array:
+        fontsize = meta_array['fontSize']
+
+    (ph, pw) = getpagedim.getPageDim(page_xml)
+    if (ph == '-1') or (ph == '0') : ph = '11000'
+    if (pw == '-1') or (pw == '0') : pw = '8500'
+
+    return stylexml2css.convert2CSS(xmlstr, fontsize, ph, pw)
+
+
+# return book.html with the body converted from the pages
+def bookHTML(meta_array, body):
+    htmlstr = '<!DOCTYPE HTML PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n'
+    htmlstr += '<html>\n'
+    htmlstr += '<head>\n'
+    htmlstr += '<meta http-equiv="content-type" content="text/html; charset=utf-8"/>\n'
+    htmlstr += '<title>' + meta_array['Title'] + ' by ' + meta_array['Authors'] + '</title>\n' 
+    htmlstr += '<meta name="Author" content="' + meta_array['Authors'] + '" />\n'
+    htmlstr += '<meta name="Title" content="' + meta_array['Title'] + '" />\n'
     htmlstr += '<link href="style.css" rel="stylesheet" type="text/css" />\n'
     htmlstr += '</head>\n<body>\n'
+    htmlstr += body
+    htmlstr += '</body>\n</html>\n'
+    return htmlstr
+
 
+# convert the pages to html, returns the body of the book
+def generateHTML(dictFile, pageDir, bookDir, filenames, classlst, fixedimage):
+    dict = convert2xml.getDictionary(dictFile)
+    htmlstr = ''
     for filename in filenames:
         print '     ', filename
         fname = os.path.join(pageDir,filename)
-        pargv=[]
-        pargv.append('convert2xml.py')
-        pargv.append('--flat-xml')
-        pargv.append(dictFile)
-        pargv.append(fname)
-        flat_xml = convert2xml.main(pargv) 
+        flat_xml = convert2xml.convertFile(dict, fname)
         htmlstr += flatxml2html.convert2HTML(flat_xml, classlst, fname, bookDir, fixedimage)
+    return htmlstr
 
-    htmlstr += '</body>\n</html>\n'
-
-    file(os.path.join(bookDir, htmlFileName), 'wb').write(htmlstr)
-    print 'Processing Complete'
-
-    return 0
 
 if __name__ == '__main__':
     sys.exit(main(''))
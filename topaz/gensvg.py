@@ -173,25 +173,27 @@ class PParser(object):
      return result
 
  def getGlyphs(self,glyfname):
+     gfile = open(glyfname, 'r')
+     result = self.getGlyphDefs(gfile.readlines())
+     gfile.close()
+     return result
+
+ # pick the definitions of the glyphs used by the page from the lines of glyphs.svg
+ def getGlyphDefs(self, lines):
      result = []
      if (self.gid != None) and (len(self.gid) > 0):
          glyphs = []
          for j in set(self.gid):
              glyphs.append(j)
          glyphs.sort()
-         gfile = open(glyfname, 'r')
          j = 0
-         while True :
-             inp = gfile.readline()
-             if (inp == ''):
-                 break
+         for inp in lines:
              id='id="gl%d"' % glyphs[j]
              if (inp.find(id) > 0):
                  result.append(inp)
                  j += 1
                  if (j == len(glyphs)):
                      break
-         gfile.close()
      return result
 
 
@@ -278,128 +280,153 @@ def main(argv):
  metadata = decode_meta.getMetaArray(fname)
 
  print 'Processing Glyphs ... '
+ glyfname = os.path.join(svgDir,'glyphs.svg')
+ generateGlyphs(dictFile, glyphsDir, glyfname, metadata)
+
+ print 'Processing Pages ... '
+ generatePages(dictFile, pageDir, svgDir, glyfname, metadata, raw)
+
+ print 'Processing Complete'
 
+ return 0
+
+
+# write the outlines of all glyphs of the book as svg paths to glyfname
+def generateGlyphs(dictFile, glyphsDir, glyfname, metadata):
+ dict = convert2xml.getDictionary(dictFile)
  filenames = os.listdir(glyphsDir)
  filenames = sorted(filenames)
 
- glyfname = os.path.join(svgDir,'glyphs.svg')
- glyfile = open(glyfname, 'w')
- glyfile.write('<?xml version="1.0" standalone="no"?>\n')
- glyfile.write('<!DOCTYPE svg PUBLIC "-//W3C/DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n')
- glyfile.write('<svg width="512" height="512" viewBox="0 0 511 511" xmlns="http://www.w3.org/2000/svg" version="1.1">\n')
- glyfile.write('<title>Glyphs for %s</title>\n' % metadata['Title'])
- glyfile.write('<defs>\n')
+ glyphs = []
  counter = 0
  for filename in filenames:
      print '     ', filename
      fname = os.path.join(glyphsDir,filename)
-     pargv=[]
-     pargv.append('convert2xml.py')
-     pargv.append('--flat-xml')
-     pargv.append(dictFile)
-     pargv.append(fname)
-     flat_xml = convert2xml.main(pargv)
-     gp = GParser(flat_xml)
-     for i in xrange(0, gp.count):
-         path = gp.getPath(i)
-         maxh, maxw = gp.getGlyphDim(i)
-         # glyfile.write('<path id="gl%d" d="%s" fill="black" />\n' % (counter * 256 + i, path))
-         glyfile.write('<path id="gl%d" d="%s" fill="black" /><!-- width=%d height=%d -->\n' % (counter * 256 + i, path, maxw, maxh ))
+     flat_xml = convert2xml.convertFile(dict, fname)
+     glyphs.extend(glyphDefs(flat_xml, counter))
      counter += 1
- glyfile.write('</defs>\n')
- glyfile.write('</svg>\n')
- glyfile.close()
-
- print 'Processing Pages ... '
-
- # Books are at 1440 DPI.  This is rendering at twice that size for
- # readability when rendering to the screen.  
- scaledpi = 1440
+ file(glyfname, 'w').write(glyphsSVG(glyphs, metadata))
+
+
+# return the svg path definitions of the glyphs in the flat xml of the
+# glyphs file with number counter, one line each
+def glyphDefs(flat_xml, counter):
+ result = []
+ gp = GParser(flat_xml)
+ for i in xrange(0, gp.count):
+     path = gp.getPath(i)
+     maxh, maxw = gp.getGlyphDim(i)
+     # result.append('<path id="gl%d" d="%s" fill="black" />\n' % (counter * 256 + i, path))
+     result.append('<path id="gl%d" d="%s" fill="black" /><!-- width=%d height=%d -->\n' % (counter * 256 + i, path, maxw, maxh ))
+ return result
+
+
+# return glyphs.svg holding the glyph definitions
+def glyphsSVG(glyphs, metadata):
+ result = []
+ result.append('<?xml version="1.0" standalone="no"?>\n')
+ result.append('<!DOCTYPE svg PUBLIC "-//W3C/DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n')
+ result.append('<svg width="512" height="512" viewBox="0 0 511 511" xmlns="http://www.w3.org/2000/svg" version="1.1">\n')
+ result.append('<title>Glyphs for %s</title>\n' % metadata['Title'])
+ result.append('<defs>\n')
+ result.extend(glyphs)
+ result.append('</defs>\n')
+ result.append('</svg>\n')
+ return ''.join(result)
+
+
+# write an svg (or xhtml with svg if not raw) file of each page to svgDir
+def generatePages(dictFile, pageDir, svgDir, glyfname, metadata, raw):
+ dict = convert2xml.getDictionary(dictFile)
  filenames = os.listdir(pageDir)
  filenames = sorted(filenames)
+ gfile = open(glyfname, 'r')
+ glyphs = gfile.readlines()
+ gfile.close()
  counter = 0
  for filename in filenames:
      print '     ', filename
      fname = os.path.join(pageDir,filename)
-     pargv=[]
-     pargv.append('convert2xml.py')
-     pargv.append('--flat-xml')
-     pargv.append(dictFile)
-     pargv.append(fname)
-     flat_xml = convert2xml.main(pargv)
-     pp = PParser(flat_xml)
+     flat_xml = convert2xml.convertFile(dict, fname)
      if (raw) :
-         pfile = open(os.path.join(svgDir,filename.replace('.dat','.svg')), 'w')
+         pname = filename.replace('.dat','.svg')
      else :
-         pfile = open(os.path.join(svgDir,'page%04d.xhtml' % counter), 'w')
+         pname = 'page%04d.xhtml' % counter
+     file(os.path.join(svgDir,pname), 'w').write(pageSVG(flat_xml, counter, len(filenames), glyphs, metadata, raw))
+     counter += 1
 
-     pfile.write('<?xml version="1.0" standalone="no"?>\n')
-     if (raw):
-         pfile.write('<!DOCTYPE svg PUBLIC "-//W3C/DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n')
-         pfile.write('<svg width="%fin" height="%fin" viewBox="0 0 %d %d" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1">\n' % (pp.pw / scaledpi, pp.ph / scaledpi, pp.pw -1, pp.ph -1))
-         pfile.write('<title>Page %d - %s by %s</title>\n' % (counter, metadata['Title'],metadata['Authors']))
+
+# return the svg (or xhtml with svg if not raw) of page number counter of
+# npages from its flat xml, glyphs are the lines of glyphs.svg
+def pageSVG(flat_xml, counter, npages, glyphs, metadata, raw):
+ # Books are at 1440 DPI.  This is rendering at twice that size for
+ # readability when rendering to the screen.  
+ scaledpi = 1440
+ pp = PParser(flat_xml)
+ result = []
+ result.append('<?xml version="1.0" standalone="no"?>\n')
+ if (raw):
+     result.append('<!DOCTYPE svg PUBLIC "-//W3C/DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n')
+     result.append('<svg width="%fin" height="%fin" viewBox="0 0 %d %d" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1">\n' % (pp.pw / scaledpi, pp.ph / scaledpi, pp.pw -1, pp.ph -1))
+     result.append('<title>Page %d - %s by %s</title>\n' % (counter, metadata['Title'],metadata['Authors']))
+ else:
+     result.append('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n');
+     result.append('<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" ><head>\n');
+     result.append('<title>Page %d - %s by %s</title>\n' % (counter, metadata['Title'],metadata['Authors']))
+     result.append('<script><![CDATA[\n');
+     result.append('function gd(){var p=window.location.href.replace(/^.*\?dpi=(\d+).*$/i,"$1");return p;}\n');
+     result.append('var dpi=%d;\n' % scaledpi);
+     if (counter) :
+        result.append('var prevpage="page%04d.xhtml";\n' % (counter - 1))
+     if (counter < npages-1) :
+        result.append('var nextpage="page%04d.xhtml";\n' % (counter + 1))
+     result.append('var pw=%d;var ph=%d;' % (pp.pw, pp.ph))
+     result.append('function zoomin(){dpi=dpi*(2/3);setsize();}\n')
+     result.append('function zoomout(){dpi=dpi*1.5;setsize();}\n')
+     result.append('function setsize(){var svg=document.getElementById("svgimg");var prev=document.getElementById("prevsvg");var next=document.getElementById("nextsvg");var width=(pw/dpi)+"in";var height=(ph/dpi)+"in";svg.setAttribute("width",width);svg.setAttribute("height",height);prev.setAttribute("height",height);prev.setAttribute("width","50px");next.setAttribute("height",height);next.setAttribute("width","50px");}\n')
+     result.append('function ppage(){window.location.href=prevpage+"?dpi="+Math.round(dpi);}\n')
+     result.append('function npage(){window.location.href=nextpage+"?dpi="+Math.round(dpi);}\n')
+     result.append('var gt=gd();if(gt>0){dpi=gt;}\n')
+     result.append('window.onload=setsize;\n')
+     result.append(']]></script>\n')
+     result.append('</head>\n')
+     result.append('<body onLoad="setsize();" style="background-color:#777;text-align:center;">\n')
+     result.append('<div style="white-space:nowrap;">\n')
+     if (counter == 0) :
+         result.append('<a href="javascript:ppage();"><svg id="prevsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"></svg></a>\n')
      else:
-         pfile.write('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n');
-         pfile.write('<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" ><head>\n');
-         pfile.write('<title>Page %d - %s by %s</title>\n' % (counter, metadata['Title'],metadata['Authors']))
-         pfile.write('<script><![CDATA[\n');
-         pfile.write('function gd(){var p=window.location.href.replace(/^.*\?dpi=(\d+).*$/i,"$1");return p;}\n');
-         pfile.write('var dpi=%d;\n' % scaledpi);
-         if (counter) :
-            pfile.write('var prevpage="page%04d.xhtml";\n' % (counter - 1))
-         if (counter < len(filenames)-1) :
-            pfile.write('var nextpage="page%04d.xhtml";\n' % (counter + 1))
-         pfile.write('var pw=%d;var ph=%d;' % (pp.pw, pp.ph))
-         pfile.write('function zoomin(){dpi=dpi*(2/3);setsize();}\n')
-         pfile.write('function zoomout(){dpi=dpi*1.5;setsize();}\n')
-         pfile.write('function setsize(){var svg=document.getElementById("svgimg");var prev=document.getElementById("prevsvg");var next=document.getElementById("nextsvg");var width=(pw/dpi)+"in";var height=(ph/dpi)+"in";svg.setAttribute("width",width);svg.setAttribute("height",height);prev.setAttribute("height",height);prev.setAttribute("width","50px");next.setAttribute("height",height);next.setAttribute("width","50px");}\n')
-         pfile.write('function ppage(){window.location.href=prevpage+"?dpi="+Math.round(dpi);}\n')
-         pfile.write('function npage(){window.location.href=nextpage+"?dpi="+Math.round(dpi);}\n')
-         pfile.write('var gt=gd();if(gt>0){dpi=gt;}\n')
-         pfile.write('window.onload=setsize;\n')
-         pfile.write(']]></script>\n')
-         pfile.write('</head>\n')
-         pfile.write('<body onLoad="setsize();" style="background-color:#777;text-align:center;">\n')
-         pfile.write('<div style="white-space:nowrap;">\n')
-         if (counter == 0) :
-             pfile.write('<a href="javascript:ppage();"><svg id="prevsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"></svg></a>\n')
-         else:
-             pfile.write('<a href="javascript:ppage();"><svg id="prevsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"><polygon points="5,150,95,5,95,295" fill="#AAAAAA" /></svg></a>\n')
-         pfile.write('<a href="javascript:npage();"><svg id="svgimg" viewBox="0 0 %d %d" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1" style="background-color:#FFF;border:1px solid black;">' % (pp.pw, pp.ph))
-
-     if (pp.gid != None): 
-         pfile.write('<defs>\n')
-         gdefs = pp.getGlyphs(glyfname)
-         for j in xrange(0,len(gdefs)):
-             pfile.write(gdefs[j])
-         pfile.write('</defs>\n')
-     img = pp.getImages()
-     if (img != None):
-         for j in xrange(0,len(img)):
-             pfile.write(img[j])
-     if (pp.gid != None): 
-         for j in xrange(0,len(pp.gid)):
-             pfile.write('<use xlink:href="#gl%d" x="%d" y="%d" />\n' % (pp.gid[j], pp.gx[j], pp.gy[j]))
-     if (img == None or len(img) == 0) and (pp.gid == None or len(pp.gid) == 0):
-         pfile.write('<text x="10" y="10" font-family="Helvetica" font-size="100" stroke="black">This page intentionally left blank.</text>\n<text x="10" y="110" font-family="Helvetica" font-size="50" stroke="black">Until this notice unintentionally gave it content.  (gensvg.py)</text>\n');
-     if (raw) :
-         pfile.write('</svg>')
+         result.append('<a href="javascript:ppage();"><svg id="prevsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"><polygon points="5,150,95,5,95,295" fill="#AAAAAA" /></svg></a>\n')
+     result.append('<a href="javascript:npage();"><svg id="svgimg" viewBox="0 0 %d %d" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1" style="background-color:#FFF;border:1px solid black;">' % (pp.pw, pp.ph))
+
+ if (pp.gid != None): 
+     result.append('<defs>\n')
+     gdefs = pp.getGlyphDefs(glyphs)
+     for j in xrange(0,len(gdefs)):
+         result.append(gdefs[j])
+     result.append('</defs>\n')
+ img = pp.getImages()
+ if (img != None):
+     for j in xrange(0,len(img)):
+         result.append(img[j])
+ if (pp.gid != None): 
+     for j in xrange(0,len(pp.gid)):
+         result.append('<use xlink:href="#gl%d" x="%d" y="%d" />\n' % (pp.gid[j], pp.gx[j], pp.gy[j]))
+ if (img == None or len(img) == 0) and (pp.gid == None or len(pp.gid) == 0):
+     result.append('<text x="10" y="10" font-family="Helvetica" font-size="100" stroke="black">This page intentionally left blank.</text>\n<text x="10" y="110" font-family="Helvetica" font-size="50" stroke="black">Until this notice unintentionally gave it content.  (gensvg.py)</text>\n');
+ if (raw) :
+     result.append('</svg>')
+ else :
+     result.append('</svg></a>\n')
+     if (counter == npages - 1) :
+         result.append('<a href="javascript:npage();"><svg id="nextsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"></svg></a>\n')
      else :
-         pfile.write('</svg></a>\n')
-         if (counter == len(filenames) - 1) :
-             pfile.write('<a href="javascript:npage();"><svg id="nextsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"></svg></a>\n')
-         else :
-             pfile.write('<a href="javascript:npage();"><svg id="nextsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"><polygon points="5,5,5,295,95,150" fill="#AAAAAA" /></svg></a>\n')
-         pfile.write('</div>\n')
-         pfile.write('<div><a href="javascript:zoomin();">zoom in</a> - <a href="javascript:zoomout();">zoom out</a></div>\n')
-         pfile.write('</body>\n')
-         pfile.write('</html>\n')
-     pfile.close()
-     counter += 1
+         result.append('<a href="javascript:npage();"><svg id="nextsvg" viewBox="0 0 100 300" xmlns="http://www.w3.org/2000/svg" version="1.1" style="background-color:#777"><polygon points="5,5,5,295,95,150" fill="#AAAAAA" /></svg></a>\n')
+     result.append('</div>\n')
+     result.append('<div><a href="javascript:zoomin();">zoom in</a> - <a href="javascript:zoomout();">zoom out</a></div>\n')
+     result.append('</body>\n')
+     result.append('</html>\n')
+ return ''.join(result)
 
- print 'Processing Complete'
-
- return 0
 
 if __name__ == '__main__':
  sys.exit(main(''))
@@ -0,0 +1,355 @@
+#!/usr/bin/python
+
+"""
+    Generator of synthetic Topaz (TPZ0) books, for testing and benchmarking
+    the Topaz conversion without real purchased books. The books hold the
+    records the converter needs (dkey, metadata, dict, other, glyphs, page
+    and img) with made up text, glyph outlines and page layouts. The page
+    and glyph records are encrypted with a book key behind a dkey record
+    that unlocks with the PID of a test Kindle serial number.
+
+    Numbers and strings are written with the encoders of topaz.cmbtc, the
+    records are encrypted with the inverse of topazCryptoDecrypt.
+"""
+
+import os
+import random
+import zlib
+
+from optparse import OptionParser
+
+import mobidedrm
+from topaz import cmbtc
+
+SERIAL = "B001A0B0C0D0E0F0"
+
+encodeNumber = cmbtc.encodeNumber
+lengthPrefixString = cmbtc.lengthPrefixString
+
+def topaz_crypto_encrypt(data, key):
+    """
+        Encrypt data so that cmbtc.topazCryptoDecrypt with the same key
+        gives it back.
+    """
+    ctx1, ctx2 = cmbtc.topazCryptoInit(key)
+    result = []
+    for char in data:
+        m = ord(char)
+        result.append(chr((m ^ ((ctx1 >> 3) & 0xFF) ^ ((ctx2 << 3) & 0xFF)) & 0xFF))
+        ctx2 = ctx1
+        ctx1 = (((ctx1 >> 2) * (ctx1 >> 7)) & 0xFFFFFFFF) ^ ((m * m * 0x0F902007) & 0xFFFFFFFF)
+    return "".join(result)
+
+def encode_negative(number):
+    """
+        Encode a negative number the way the readers decode it. This is not
+        what encodeNumber does, it gives -number - 1 for them.
+    """
+    return chr(0xFF) + encodeNumber(-number)
+
+class StringTable(object):
+    """
+        The string table of a book (the dict record). It holds the names of
+        the tags as well as all text of the book.
+    """
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, string):
+        """
+            Return the index of string, adding it if it is new.
+        """
+        if string not in self.index:
+            self.index[string] = len(self.strings)
+            self.strings.append(string)
+        return self.index[string]
+
+    def encode(self):
+        return encodeNumber(len(self.strings)) + "".join([lengthPrefixString(s) for s in self.strings])
+
+class PageWriter(object):
+    """
+        Encodes the tags of page, glyph and stylesheet records, see
+        topaz.convert2xml.PageParser for how they are read back.
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def tag(self, name, subtags=None, args=""):
+        """
+            Encode a tag. subtags is the list of encoded subtags of tags
+            that have them and args the encoded arguments.
+        """
+        data = encodeNumber(self.table.add(name))
+        if subtags is not None:
+            data += encodeNumber(len(subtags)) + "".join(subtags)
+        return data + args
+
+    def number(self, value):
+        return encodeNumber(value)
+
+    def text(self, value):
+        return encodeNumber(self.table.add(value))
+
+    def vector(self, values):
+        """
+            Encode a vector of numbers as a 0x76 loop. Increasing vectors
+            are stored as the differences between their values.
+        """
+        mode = 0
+        if len(values) > 1 and all([values[i] <= values[i+1] for i in xrange(len(values) - 1)]):
+            mode = 2
+            values = [values[0]] + [values[i+1] - values[i] for i in xrange(len(values) - 1)]
+        return chr(0x76) + encodeNumber(len(values)) + encodeNumber(mode) + "".join([encodeNumber(v) for v in values])
+
+    def texts(self, values):
+        return self.vector([self.table.add(v) for v in values])
+
+    def snippets(self, snippets):
+        """
+            Encode a list of snippets, the first of them is the root of
+            the document that the others get injected into.
+        """
+        return chr(0x72) + encodeNumber(len(snippets)) + "".join(snippets)
+
+def make_word(rnd):
+    return "".join([rnd.choice("etaoinshrdlucmfwypvbgk") for i in xrange(rnd.randint(1, 10))])
+
+def make_glyphs(rnd, writer, count):
+    """
+        Return a glyphs record with count glyph outlines.
+    """
+    heights, widths, uses, vtx, lens, dpis = [], [], [], [], [], []
+    xs, ys, ends = [], [], []
+    for glyph in xrange(count):
+        dpi = rnd.choice((600, 1200, 1440))
+        heights.append(rnd.randint(100, 400))
+        widths.append(rnd.randint(50, 400))
+        uses.append(rnd.randint(1, 1000))
+        dpis.append(dpi)
+        vtx.append(len(xs))
+        lens.append(len(ends))
+        points = 0
+        for contour in xrange(rnd.randint(1, 3)):
+            for point in xrange(rnd.randint(3, 12)):
+                xs.append(rnd.randint(0, 400))
+                ys.append(rnd.randint(0, 400))
+                points += 1
+            ends.append(points - 1)
+    glyph = writer.tag("glyph", [
+        writer.tag("h", args=writer.vector(heights)),
+        writer.tag("w", args=writer.vector(widths)),
+        writer.tag("use", args=writer.vector(uses)),
+        writer.tag("vtx", args=writer.vector(vtx)),
+        writer.tag("len", args=writer.vector(lens)),
+        writer.tag("dpi", args=writer.vector(dpis)),
+    ])
+    vertices = writer.tag("vtx", [
+        writer.tag("x", args=writer.vector(xs)),
+        writer.tag("y", args=writer.vector(ys)),
+    ])
+    contours = writer.tag("len", [writer.tag("n", args=writer.vector(ends))])
+    # the info tag is implied by the magic
+    return "g\x00__GLYPH\x00\x00\x00" + writer.number(3) + glyph + vertices + contours
+
+def make_page(rnd, writer, vocabulary, words, glyphs_per_word, glyph_count, images, classes, width=8500, height=11000):
+    """
+        Return a page record with words of text laid out in paragraphs and
+        a glyph for every letter, and the given image numbers.
+    """
+    ocr = [rnd.choice(vocabulary) for i in xrange(words)]
+    gx, gy, gid = [], [], []
+    x, y = 500, 500
+    for word in ocr:
+        for i in xrange(glyphs_per_word):
+            gx.append(x)
+            gy.append(y)
+            gid.append(rnd.randint(0, glyph_count - 1))
+            x += rnd.randint(60, 120)
+        x += 100
+        if x > width - 500:
+            x = 500
+            y += 250
+
+    info = writer.number(2)
+    info += writer.tag("word", [writer.tag("ocrText", args=writer.texts(ocr))])
+    info += writer.tag("glyph", [
+        writer.tag("x", args=writer.vector(gx)),
+        writer.tag("y", args=writer.vector(gy)),
+        writer.tag("glyphID", args=writer.vector(gid)),
+    ])
+
+    # snippet 0 is the page, then a region with its content per paragraph
+    # and per image
+    snippets = []
+    regions = []
+    first = 0
+    while first < words:
+        last = min(words, first + rnd.randint(20, 120))
+        regions.append(len(snippets) + 1)
+        snippets.append(writer.tag("region", [
+            writer.tag("type", args=writer.text("text")),
+        ], writer.vector([len(snippets) + 2])))
+        snippets.append(writer.tag("paragraph", [
+            writer.tag("class", args=writer.text(rnd.choice(classes))),
+            writer.tag("firstWord", args=writer.number(first)),
+            writer.tag("lastWord", args=writer.number(last)),
+        ], writer.vector([])))
+        first = last
+    for image in images:
+        regions.append(len(snippets) + 1)
+        snippets.append(writer.tag("region", [
+            writer.tag("type", args=writer.text("graphic")),
+        ], writer.vector([len(snippets) + 2])))
+        snippets.append(writer.tag("img", [
+            writer.tag("x", args=writer.number(rnd.randint(0, width // 2))),
+            writer.tag("y", args=writer.number(rnd.randint(0, height // 2))),
+            writer.tag("h", args=writer.number(rnd.randint(100, height // 2))),
+            writer.tag("w", args=writer.number(rnd.randint(100, width // 2))),
+            writer.tag("src", args=writer.number(image)),
+        ], writer.vector([])))
+    page = writer.tag("page", [
+        writer.tag("type", args=writer.text("text")),
+        writer.tag("h", args=writer.number(height)),
+        writer.tag("w", args=writer.number(width)),
+    ], writer.vector(regions))
+    return "p\x00__PAGE_\x00\x00" + info + writer.snippets([page] + snippets)
+
+def make_stylesheet(writer, classes):
+    """
+        Return the other record, which holds the stylesheet with a style for
+        each paragraph class.
+    """
+    snippets = []
+    styles = []
+    for index, name in enumerate(classes):
+        rules = (("margin-top", str(100 * index)), ("indent", str(300 + index)), ("align", "justify"))
+        # snippets 0 and 1 are the book and the stylesheet, the rules of a
+        # style follow it
+        first = len(snippets) + 3
+        styles.append(len(snippets) + 2)
+        snippets.append(writer.tag("style", [
+            writer.tag("type", args=writer.text("paragraph")),
+            writer.tag("class", args=writer.text(name)),
+        ], writer.vector(range(first, first + len(rules)))))
+        for attr, value in rules:
+            snippets.append(writer.tag("rule", [
+                writer.tag("attr", args=writer.text(attr)),
+                writer.tag("value", args=writer.text(value)),
+            ], writer.vector([])))
+    book = writer.tag("book", [], writer.vector([1]))
+    stylesheet = writer.tag("stylesheet", [], writer.vector(styles))
+    return writer.snippets([book, stylesheet] + snippets)
+
+def make_metadata(fields):
+    data = encodeNumber(len(fields))
+    for key, value in fields:
+        data += lengthPrefixString(key) + lengthPrefixString(value)
+    return data
+
+def make_dkey(rnd, pid, book_key):
+    """
+        Return the dkey record, the book key for the PID next to a decoy.
+    """
+    data = chr(2)
+    for record_pid in ("".join([rnd.choice("ABCDEFGH") for i in xrange(8)]), pid):
+        record = "PID" + chr(8) + record_pid + chr(8) + book_key + "pid"
+        encrypted = topaz_crypto_encrypt(record, record_pid)
+        data += chr(len(encrypted)) + encrypted
+    return data
+
+def make_book(serial=SERIAL, pages=20, words_per_page=300, glyphs_per_word=5,
+              glyph_count=1024, images=5, image_size=32 << 10, seed=0):
+    """
+        Return a synthetic Topaz book as a string.
+
+        The book has pages pages of words_per_page words each, with a glyph
+        for every letter, which are drawn from glyph_count glyph outlines.
+        The images of image_size bytes are spread over the pages. It can be
+        decrypted with the first 8 characters of the PID of the Kindle
+        serial number.
+    """
+    rnd = random.Random(seed)
+    pid = mobidedrm.getPid(serial)[:8]
+    book_key = "".join([chr(rnd.getrandbits(8)) for i in xrange(8)])
+    table = StringTable()
+    writer = PageWriter(table)
+    vocabulary = [make_word(rnd) for i in xrange(2000)]
+    classes = ["para_%d" % i for i in xrange(4)]
+
+    # (name, data, encrypted, compressed) of every record
+    records = []
+    records.append(("dkey", make_dkey(rnd, pid, book_key), False, False))
+    records.append(("metadata", make_metadata([
+        ("Title", "Synthetic Book %d" % seed),
+        ("Authors", "Topaz Generator"),
+        ("fontSize", "135"),
+        ("firstTextPage", "0"),
+    ]), False, False))
+    records.append(("other", make_stylesheet(writer, classes), True, True))
+    for first in xrange(0, glyph_count, 256):
+        records.append(("glyphs", make_glyphs(rnd, writer, min(256, glyph_count - first)), True, True))
+    page_images = [[] for i in xrange(pages)]
+    for image in xrange(images):
+        page_images[image * pages // max(images, 1)].append(image)
+    for page in xrange(pages):
+        records.append(("page", make_page(rnd, writer, vocabulary, words_per_page, glyphs_per_word,
+                                          glyph_count, page_images[page], classes), True, True))
+    for image in xrange(images):
+        data = "\xff\xd8\xff\xe0" + "".join([chr(rnd.getrandbits(8)) for i in xrange(image_size - 4)])
+        records.append(("img", data, True, False))
+    # the string table is complete once all the other records are written
+    records.insert(2, ("dict", table.encode(), True, True))
+
+    header = {}
+    names = []
+    payload = []
+    offset = 0
+    for name, data, encrypted, compressed in records:
+        if name not in header:
+            header[name] = []
+            names.append(name)
+        index = len(header[name])
+        size = len(data)
+        compressed_size = 0
+        if compressed:
+            data = zlib.compress(data)
+            compressed_size = len(data)
+        if encrypted:
+            data = topaz_crypto_encrypt(data, book_key)
+            record = lengthPrefixString(name) + encode_negative(-index - 1) + data
+        else:
+            record = lengthPrefixString(name) + encodeNumber(index) + data
+        header[name].append((offset, size, compressed_size))
+        payload.append(record)
+        offset += len(record)
+
+    result = ["TPZ0", encodeNumber(len(names))]
+    for name in names:
+        result.append(chr(0x63) + lengthPrefixString(name) + encodeNumber(len(header[name])))
+        for values in header[name]:
+            result.append("".join([encodeNumber(v) for v in values]))
+    result.append(chr(0x64))
+    return "".join(result + payload)
+
+if __name__ == "__main__":
+    parser = OptionParser("usage: %prog [options] output.tpz")
+    parser.add_option("-s", "--serial", default=SERIAL,
+                      help="Kindle serial number the book is for [%default]")
+    parser.add_option("-p", "--pages", type="int", default=20,
+                      help="Number of pages [%default]")
+    parser.add_option("-w", "--words", type="int", default=300,
+                      help="Number of words per page [%default]")
+    parser.add_option("-g", "--glyphs-per-word", type="int", default=5,
+                      help="Number of glyphs per word [%default]")
+    parser.add_option("-i", "--images", type="int", default=5,
+                      help="Number of images [%default]")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("no output file given")
+
+    print "PID: %s" % mobidedrm.getPid(options.serial)[:8]
+    open(args[0], "wb").write(make_book(options.serial, options.pages, options.words,
+                                        options.glyphs_per_word, images=options.images))
+    print "%s: %d bytes" % (args[0], os.path.getsize(args[0]))